@@ -0,0 +1,93 @@
+# almacen.py
+
+import numpy as np
+import pandas as pd
+
+class AlmacenTransacciones:
+    """
+    Transacciones ordenadas una sola vez por fecha, con índices de posiciones por fecha y por
+    las columnas de `claves`. Los cortes por año, rango de fechas o clave son búsquedas binarias
+    (searchsorted) sobre arrays ya ordenados, sin máscaras sobre todo el DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columna_fecha: str = "Date",
+                 claves: tuple[str, ...] = ("Transaction Type", "Outgoing Asset")):
+        fechas = pd.to_datetime(df[columna_fecha])
+        if not fechas.is_monotonic_increasing:
+            orden = np.argsort(fechas.to_numpy(), kind="stable")
+            df, fechas = df.iloc[orden], fechas.iloc[orden]
+        self.df = df
+        self.columna_fecha = columna_fecha
+        self.claves = tuple(claves)
+        self.fechas = fechas.to_numpy(dtype="datetime64[ns]")
+        self.indices = {}
+        if self.claves and len(df):
+            grupos = df.groupby(list(self.claves), observed=True, sort=False).indices
+            self.indices = {self._clave(k): np.asarray(p, dtype=np.int64) for k, p in grupos.items()}
+
+    @classmethod
+    def _desde_partes(cls, df, columna_fecha, claves, fechas, indices) -> "AlmacenTransacciones":
+        almacen = cls.__new__(cls)
+        almacen.df, almacen.columna_fecha, almacen.claves = df, columna_fecha, claves
+        almacen.fechas, almacen.indices = fechas, indices
+        return almacen
+
+    @staticmethod
+    def _clave(clave) -> tuple:
+        return clave if isinstance(clave, tuple) else (clave,)
+
+    @staticmethod
+    def _fecha(fecha) -> np.datetime64:
+        return np.datetime64(pd.Timestamp(fecha), "ns")
+
+    def __len__(self):
+        return len(self.df)
+
+    def _corte(self, fechas: np.ndarray, desde=None, hasta=None) -> tuple[int, int]:
+        # Ambos extremos incluidos
+        inicio = 0 if desde is None else int(np.searchsorted(fechas, self._fecha(desde), side="left"))
+        fin = len(fechas) if hasta is None else int(np.searchsorted(fechas, self._fecha(hasta), side="right"))
+        return inicio, max(inicio, fin)
+
+    def rango(self, desde=None, hasta=None) -> pd.DataFrame:
+        inicio, fin = self._corte(self.fechas, desde, hasta)
+        return self.df.iloc[inicio:fin]
+
+    def año(self, año: int) -> pd.DataFrame:
+        return self.rango(pd.Timestamp(año, 1, 1), pd.Timestamp(año, 12, 31, 23, 59, 59))
+
+    def recortar(self, hasta) -> "AlmacenTransacciones":
+        """
+        Almacén con las transacciones hasta `hasta` (incluida). Comparte datos e índices con
+        este: solo se recortan los arrays, sin volver a ordenar ni agrupar.
+        """
+        _, fin = self._corte(self.fechas, hasta=hasta)
+        indices = {}
+        for clave, posiciones in self.indices.items():
+            posiciones = posiciones[:np.searchsorted(posiciones, fin)]
+            if len(posiciones):
+                indices[clave] = posiciones
+        return self._desde_partes(self.df.iloc[:fin], self.columna_fecha, self.claves, self.fechas[:fin], indices)
+
+    def posiciones(self, *claves, desde=None, hasta=None) -> np.ndarray:
+        """
+        Posiciones (ordenadas por fecha) de las filas de cualquiera de las `claves` en el rango.
+        """
+        partes = []
+        for clave in claves:
+            posiciones = self.indices.get(self._clave(clave))
+            if posiciones is not None:
+                inicio, fin = self._corte(self.fechas[posiciones], desde, hasta)
+                partes.append(posiciones[inicio:fin])
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return partes[0] if len(partes) == 1 else np.sort(np.concatenate(partes))
+
+    def filas(self, *claves, desde=None, hasta=None) -> pd.DataFrame:
+        return self.df.iloc[self.posiciones(*claves, desde=desde, hasta=hasta)]
+
+    def retiradas(self, desde=None, hasta=None) -> pd.DataFrame:
+        """
+        Retiradas de EUR a la cuenta bancaria (Non-taxable con salida en EUR).
+        """
+        return self.filas(("Non-taxable", "EUR"), desde=desde, hasta=hasta)
@@ -0,0 +1,110 @@
+# batch.py
+#
+# Procesa en lote las carpetas de varios clientes sin cargar Streamlit:
+#   python batch.py clientes/ --salida informes/ --año 2024 --formato parquet --workers 8
+#   python batch.py clientes/ --salida informes/ --todos-los-años
+#   python batch.py clientes/ --salida informes/ --precios data/precios
+#   python batch.py clientes/ --salida informes/ --por-trozos   (exportaciones muy grandes)
+# Cada subcarpeta de `clientes/` contiene los CSV de Bitpanda de un contribuyente.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import pandas as pd
+from pipeline import ejecutar_pipeline, ejecutar_informe_plurianual
+from precios import cargar_precios
+
+FORMATOS = ("parquet", "csv", "json")
+
+def guardar_tabla(df: pd.DataFrame, ruta_base: str, formato: str):
+    if formato == "parquet":
+        df.to_parquet(ruta_base + ".parquet", index=False)
+    elif formato == "csv":
+        df.to_csv(ruta_base + ".csv", sep=";", index=False)
+    else:
+        df.to_json(ruta_base + ".json", orient="records", date_format="iso", force_ascii=False, indent=2)
+
+# Los precios se cargan una vez por proceso y se comparten entre sus clientes
+_precios = lru_cache(maxsize=None)(cargar_precios)
+
+def procesar_cliente(directorio: str, salida: str, año_fiscal: int | None, formato: str,
+                     directorio_precios: str | None = None, por_trozos: bool = False) -> dict:
+    """
+    Procesa un cliente. Con año_fiscal=None genera el informe de todos los años en una sola pasada.
+    Con directorio_precios se valoran a mercado las permutas, el staking y las comisiones en cripto.
+    """
+    cliente = os.path.basename(os.path.normpath(directorio))
+    file_paths = sorted(glob.glob(os.path.join(directorio, "*.csv")))
+    inicio = time.perf_counter()
+    try:
+        if not file_paths:
+            raise FileNotFoundError(f"No hay CSV en {directorio}")
+        precios = _precios(directorio_precios) if directorio_precios else None
+        if año_fiscal is None:
+            resultado, tiempos = ejecutar_informe_plurianual(file_paths, precios=precios, por_trozos=por_trozos)
+        else:
+            resultado, tiempos = ejecutar_pipeline(file_paths, año_fiscal, precios, por_trozos)
+
+        directorio_cliente = os.path.join(salida, cliente)
+        os.makedirs(directorio_cliente, exist_ok=True)
+        inicio_escritura = time.perf_counter()
+        guardar_tabla(resultado["plusvalias"], os.path.join(directorio_cliente, "plusvalias"), formato)
+        if año_fiscal is None:
+            guardar_tabla(resultado["informe"], os.path.join(directorio_cliente, "informe"), formato)
+            filas = resultado["informe"].to_dict("records")
+        else:
+            with open(os.path.join(directorio_cliente, "resumen.json"), "w", encoding="utf-8") as f:
+                json.dump(resultado["resumen"], f, ensure_ascii=False, indent=2)
+            filas = [resultado["resumen"]]
+        tiempos["escritura"] = time.perf_counter() - inicio_escritura
+
+        # Un cliente sin operaciones (CSV solo con cabecera) también tiene su fila en el resumen
+        resumen = [{"Cliente": cliente, "Error": "", **fila} for fila in filas] or [{"Cliente": cliente, "Error": ""}]
+    except Exception as e:
+        tiempos = {}
+        resumen = [{"Cliente": cliente, "Error": f"{type(e).__name__}: {e}"}]
+    tiempos["total"] = time.perf_counter() - inicio
+    return {"resumen": resumen, "tiempos": {"Cliente": cliente, **tiempos}}
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Cálculo de plusvalías en lote para varios clientes.")
+    parser.add_argument("clientes", help="Directorio con una subcarpeta de CSV por cliente")
+    parser.add_argument("--salida", default="informes", help="Directorio de salida")
+    parser.add_argument("--año", type=int, default=time.localtime().tm_year - 1, help="Año fiscal a declarar")
+    parser.add_argument("--todos-los-años", action="store_true",
+                        help="Informe de todos los años en una sola pasada (ignora --año)")
+    parser.add_argument("--formato", choices=FORMATOS, default="parquet")
+    parser.add_argument("--precios", help="Directorio con ficheros de precios en EUR (CSV o Parquet)")
+    parser.add_argument("--por-trozos", action="store_true",
+                        help="Leer los CSV por trozos con memoria acotada (exportaciones muy grandes)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Clientes procesados en paralelo")
+    args = parser.parse_args(argv)
+
+    directorios = sorted(d for d in glob.glob(os.path.join(args.clientes, "*")) if os.path.isdir(d))
+    if not directorios:
+        print(f"No se han encontrado carpetas de clientes en {args.clientes}", file=sys.stderr)
+        return 1
+    os.makedirs(args.salida, exist_ok=True)
+
+    with ProcessPoolExecutor(max(1, args.workers)) as pool:
+        salidas = list(pool.map(procesar_cliente, directorios, [args.salida] * len(directorios),
+                                [None if args.todos_los_años else args.año] * len(directorios), [args.formato] * len(directorios),
+                                [args.precios] * len(directorios), [args.por_trozos] * len(directorios)))
+
+    resumenes = pd.DataFrame([fila for s in salidas for fila in s["resumen"]])
+    tiempos = pd.DataFrame([s["tiempos"] for s in salidas])
+    guardar_tabla(resumenes, os.path.join(args.salida, "resumen"), args.formato)
+    guardar_tabla(tiempos, os.path.join(args.salida, "tiempos"), args.formato)
+
+    print(tiempos.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    errores = sum(any(fila["Error"] for fila in s["resumen"]) for s in salidas)
+    print(f"\n{len(directorios) - errores}/{len(directorios)} clientes procesados → {args.salida}")
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# benchmark.py
+#
+# Mide las etapas críticas sobre ledgers sintéticos de distintos tamaños:
+#   python benchmark.py --filas 10000 100000 1000000 --guardar baseline.json
+#   python benchmark.py --filas 10000 100000 --comparar baseline.json --tolerancia 0.2
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from data_loader import load_multiple_csvs, preprocess_df
+from processor import calcular_plusvalias_fifo, construir_cubo, resumen_por_cripto
+from tax_utils import filtrar_plusvalias_sobre_retiradas, resumen_fiscal
+from generador_sintetico import generar_ledger, escribir_csvs
+
+def _medir(funcion, memoria: bool):
+    gc.collect()
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    pico = None
+    if memoria:
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return resultado, segundos, pico
+
+def ejecutar_etapas(file_paths: list[str], memoria: bool) -> dict[str, dict]:
+    """
+    Ejecuta cada etapa una vez y devuelve, por etapa: segundos, filas de entrada y pico de memoria.
+    """
+    etapas = {}
+
+    def registrar(nombre, funcion, filas_entrada):
+        resultado, segundos, pico = _medir(funcion, memoria)
+        etapas[nombre] = {"segundos": segundos, "filas": filas_entrada, "pico_bytes": pico}
+        return resultado
+
+    df_raw = registrar("load_multiple_csvs", lambda: load_multiple_csvs(file_paths), None)
+    etapas["load_multiple_csvs"]["filas"] = len(df_raw)
+    df = registrar("preprocess_df", lambda: resumen_fiscal(preprocess_df(df_raw, compacto=True)), len(df_raw))
+    resultados = registrar("calcular_plusvalias_fifo", lambda: calcular_plusvalias_fifo(df), len(df))
+    registrar("filtrar_plusvalias_sobre_retiradas",
+              lambda: filtrar_plusvalias_sobre_retiradas(df, resultados), len(df))
+    registrar("agregaciones", lambda: resumen_por_cripto(construir_cubo(resultados)), len(resultados))
+    return etapas
+
+def ejecutar_benchmark(tamaños: list[int], activos: int, duplicados: float, ficheros: int,
+                       memoria: bool = True) -> dict:
+    informe = {
+        "python": sys.version.split()[0],
+        "plataforma": platform.platform(),
+        "resultados": {},
+    }
+    for filas in tamaños:
+        with tempfile.TemporaryDirectory() as directorio:
+            rutas = escribir_csvs(generar_ledger(filas, activos, tasa_duplicados=duplicados), directorio, ficheros)
+            # Primera pasada solo tiempos; la segunda con tracemalloc, que ralentiza la ejecución
+            etapas = ejecutar_etapas(rutas, memoria=False)
+            if memoria:
+                for nombre, medida in ejecutar_etapas(rutas, memoria=True).items():
+                    etapas[nombre]["pico_bytes"] = medida["pico_bytes"]
+        for medida in etapas.values():
+            medida["filas_por_segundo"] = medida["filas"] / medida["segundos"] if medida["segundos"] else None
+        informe["resultados"][str(filas)] = etapas
+    return informe
+
+def imprimir(informe: dict, referencia: dict | None = None):
+    print(f"{'filas':>9}  {'etapa':<36}{'segundos':>10}{'filas/s':>14}{'pico MB':>10}{'vs base':>9}")
+    for filas, etapas in informe["resultados"].items():
+        for nombre, medida in etapas.items():
+            pico = f"{medida['pico_bytes'] / 2**20:.1f}" if medida["pico_bytes"] is not None else "-"
+            comparacion = ""
+            base = (referencia or {}).get("resultados", {}).get(filas, {}).get(nombre)
+            if base:
+                comparacion = f"{medida['segundos'] / base['segundos']:.2f}x"
+            print(f"{filas:>9}  {nombre:<36}{medida['segundos']:>10.3f}"
+                  f"{medida['filas_por_segundo'] or 0:>14,.0f}{pico:>10}{comparacion:>9}")
+
+def regresiones(informe: dict, referencia: dict, tolerancia: float) -> list[str]:
+    """
+    Etapas cuyo tiempo supera al de la referencia en más de `tolerancia` (0.2 = +20 %).
+    """
+    encontradas = []
+    for filas, etapas in informe["resultados"].items():
+        for nombre, medida in etapas.items():
+            base = referencia.get("resultados", {}).get(filas, {}).get(nombre)
+            if base and medida["segundos"] > base["segundos"] * (1 + tolerancia):
+                encontradas.append(f"{nombre} @ {filas} filas: {base['segundos']:.3f}s → {medida['segundos']:.3f}s")
+    return encontradas
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline fiscal con ledgers sintéticos.")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--activos", type=int, default=20)
+    parser.add_argument("--duplicados", type=float, default=0.02)
+    parser.add_argument("--ficheros", type=int, default=4)
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir el pico de memoria")
+    parser.add_argument("--guardar", help="Guardar los resultados como referencia en este JSON")
+    parser.add_argument("--comparar", help="JSON de referencia con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    referencia = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            referencia = json.load(f)
+
+    informe = ejecutar_benchmark(args.filas, args.activos, args.duplicados, args.ficheros, not args.sin_memoria)
+    imprimir(informe, referencia)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2)
+    if referencia:
+        encontradas = regresiones(informe, referencia, args.tolerancia)
+        for regresion in encontradas:
+            print(f"REGRESIÓN {regresion}", file=sys.stderr)
+        return 1 if encontradas else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
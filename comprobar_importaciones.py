@@ -0,0 +1,82 @@
+# comprobar_importaciones.py
+#
+# Comprueba que el núcleo de cálculo se importa sin la pila de interfaz y que ningún módulo se pasa
+# de su presupuesto de tiempo de importación (cada medida en un intérprete nuevo):
+#   python comprobar_importaciones.py
+#   python comprobar_importaciones.py --repeticiones 5 --margen 2
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Módulos sin interfaz: los usan batch.py, pipeline.py y los trabajos en segundo plano
+MODULOS_NUCLEO = [
+    "instrumentacion", "data_loader", "almacen", "consultas", "lots", "snapshots", "processor",
+    "tax_utils", "precios", "ledger", "trabajos", "pipeline", "batch",
+]
+PROHIBIDOS_NUCLEO = ["streamlit", "plotly", "st_aggrid", "matplotlib"]
+# La interfaz sí carga streamlit, pero plotly.express y st_aggrid se importan al dibujar
+PROHIBIDOS_INTERFAZ = ["plotly.express", "st_aggrid"]
+
+# Segundos por encima de la base (pandas, numpy y pyarrow, que el núcleo necesita de todas formas)
+PRESUPUESTO_NUCLEO = 0.25
+PRESUPUESTO_INTERFAZ = 0.5
+
+_MEDIR = """
+import json, sys, time
+inicio = time.perf_counter()
+import numpy, pandas, pyarrow
+base = time.perf_counter() - inicio
+inicio = time.perf_counter()
+import {modulo}
+print(json.dumps({{"base": base, "modulo": time.perf_counter() - inicio, "cargados": sorted(sys.modules)}}))
+"""
+
+def medir(modulo: str, repeticiones: int) -> dict:
+    """
+    Importa `modulo` en `repeticiones` intérpretes nuevos y se queda con la medida más rápida.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    medidas = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", _MEDIR.format(modulo=modulo)], cwd=directorio,
+                                capture_output=True, text=True, check=True).stdout
+        medidas.append(json.loads(salida.splitlines()[-1]))
+    return min(medidas, key=lambda m: m["modulo"])
+
+def comprobar(repeticiones: int = 3, margen: float = 1.0) -> list[str]:
+    """
+    Imprime el tiempo de importación de cada módulo y devuelve los problemas encontrados.
+    """
+    modulos = [(m, PROHIBIDOS_NUCLEO, PRESUPUESTO_NUCLEO) for m in MODULOS_NUCLEO]
+    modulos.append(("visualizer", PROHIBIDOS_INTERFAZ, PRESUPUESTO_INTERFAZ))
+
+    problemas = []
+    print(f"{'módulo':<18}{'base s':>9}{'módulo s':>10}{'límite s':>10}")
+    for modulo, prohibidos, presupuesto in modulos:
+        medida = medir(modulo, repeticiones)
+        limite = presupuesto * margen
+        print(f"{modulo:<18}{medida['base']:>9.3f}{medida['modulo']:>10.3f}{limite:>10.2f}")
+        if medida["modulo"] > limite:
+            problemas.append(f"{modulo} tarda {medida['modulo']:.3f}s en importarse (límite {limite:.2f}s)")
+        cargados = set(medida["cargados"])
+        for prohibido in prohibidos:
+            if prohibido in cargados:
+                problemas.append(f"{modulo} importa {prohibido}")
+    return problemas
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Tiempo de importación y dependencias del núcleo de cálculo.")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Intérpretes por módulo (se toma el más rápido)")
+    parser.add_argument("--margen", type=float, default=1.0, help="Multiplica los presupuestos (máquinas lentas)")
+    args = parser.parse_args(argv)
+
+    problemas = comprobar(args.repeticiones, args.margen)
+    for problema in problemas:
+        print(f"REGRESIÓN {problema}", file=sys.stderr)
+    return 1 if problemas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
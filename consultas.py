@@ -0,0 +1,81 @@
+# consultas.py
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+class ConsultaTabla:
+    """
+    Acceso a una tabla en Arrow desde el servidor: filtros, totales y páginas ordenadas.
+    A la interfaz solo llega la página visible, nunca la tabla completa.
+    """
+
+    def __init__(self, datos: pd.DataFrame | pa.Table):
+        if isinstance(datos, pd.DataFrame):
+            datos = pa.Table.from_pandas(datos, preserve_index=False)
+        # Las columnas diccionario (categóricas) se decodifican para poder ordenarlas
+        campos = [
+            pa.field(campo.name, campo.type.value_type) if pa.types.is_dictionary(campo.type) else campo
+            for campo in datos.schema
+        ]
+        self.tabla = datos.cast(pa.schema(campos)).replace_schema_metadata(None)
+
+    def __len__(self):
+        return self.tabla.num_rows
+
+    @property
+    def columnas(self) -> list[str]:
+        return self.tabla.column_names
+
+    def valores_unicos(self, columna: str) -> list:
+        valores = pc.unique(self.tabla[columna]).drop_null()
+        return sorted(valores.to_pylist())
+
+    def filtrar(self, valores: dict[str, list] | None = None, columna_fecha: str | None = None,
+                desde=None, hasta=None) -> "ConsultaTabla":
+        """
+        Filtra por valores permitidos en cada columna (lista vacía = sin filtro) y por un rango
+        de fechas con ambos extremos incluidos.
+        """
+        mascara = None
+
+        def combinar(condicion):
+            nonlocal mascara
+            mascara = condicion if mascara is None else pc.and_(mascara, condicion)
+
+        for columna, permitidos in (valores or {}).items():
+            if permitidos:
+                tipo = self.tabla.schema.field(columna).type
+                combinar(pc.is_in(self.tabla[columna], value_set=pa.array(list(permitidos), type=tipo)))
+        if columna_fecha is not None:
+            tipo = self.tabla.schema.field(columna_fecha).type
+            if pa.types.is_timestamp(tipo):
+                desde = pd.Timestamp(desde) if desde is not None else None
+                hasta = pd.Timestamp(hasta) if hasta is not None else None
+            if desde is not None:
+                combinar(pc.greater_equal(self.tabla[columna_fecha], pa.scalar(desde, type=tipo)))
+            if hasta is not None:
+                combinar(pc.less_equal(self.tabla[columna_fecha], pa.scalar(hasta, type=tipo)))
+
+        if mascara is None:
+            return self
+        return ConsultaTabla(self.tabla.filter(pc.fill_null(mascara, False)))
+
+    def totales(self, columnas: list[str] | None = None) -> dict[str, float]:
+        if columnas is None:
+            columnas = [c.name for c in self.tabla.schema if pa.types.is_integer(c.type) or pa.types.is_floating(c.type)]
+        return {columna: pc.sum(self.tabla[columna]).as_py() or 0 for columna in columnas}
+
+    def num_paginas(self, tamaño: int) -> int:
+        return max(1, -(-len(self) // tamaño))
+
+    def pagina(self, numero: int, tamaño: int, orden: str | None = None, descendente: bool = False) -> pd.DataFrame:
+        """
+        Devuelve la página `numero` (empezando en 1). Solo se materializan las filas de esa página.
+        """
+        inicio = (max(1, numero) - 1) * tamaño
+        if orden is None:
+            return self.tabla.slice(inicio, tamaño).to_pandas()
+        indices = pc.sort_indices(self.tabla, [(orden, "descending" if descendente else "ascending")])
+        return self.tabla.take(indices.slice(inicio, tamaño)).to_pandas()
@@ -1,7 +1,16 @@
 # data_loader.py
 
 import pandas as pd
+import numpy as np
 import os
+import io
+import hashlib
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from instrumentacion import medir_etapa
 
 COLUMNS = [
     "Date (UTC)", "Integration Name", "Label", "Outgoing Asset", "Outgoing Amount",
@@ -9,14 +18,19 @@ COLUMNS = [
     "Comment (optional)", "Trx. ID (optional)", "Source Type", "Source Name"
 ]
 
-def load_bitpanda_csv(file_path: str) -> pd.DataFrame:
-    df = pd.read_csv(file_path, sep=";", parse_dates=["Date (UTC)"], dayfirst=True)
-    df.columns = [col.strip() for col in df.columns]
+def load_bitpanda_csv(file_path: str, engine: str = "c") -> pd.DataFrame:
+    if engine == "pyarrow":
+        # El lector de pyarrow libera el GIL pero no admite dayfirst: la fecha se convierte después
+        df = pd.read_csv(file_path, sep=";", engine="pyarrow")
+        df.columns = [col.strip() for col in df.columns]
+        df["Date (UTC)"] = pd.to_datetime(df["Date (UTC)"], dayfirst=True)
+    else:
+        df = pd.read_csv(file_path, sep=";", parse_dates=["Date (UTC)"], dayfirst=True)
+        df.columns = [col.strip() for col in df.columns]
     df = df[COLUMNS]  # Ordenamos y seleccionamos columnas relevantes
     return df
 
-def load_multiple_csvs(file_paths: list[str]) -> pd.DataFrame:
-    dfs = [load_bitpanda_csv(path) for path in file_paths]
+def combinar_transacciones(dfs: list[pd.DataFrame]) -> pd.DataFrame:
     combined_df = pd.concat(dfs, ignore_index=True)
     combined_df.sort_values(by="Date (UTC)", inplace=True)
     
@@ -28,30 +42,363 @@ def load_multiple_csvs(file_paths: list[str]) -> pd.DataFrame:
     
     return combined_df
 
+def _leer_en_paralelo(lector, elementos: list, workers: int | None, modo: str) -> list[pd.DataFrame]:
+    """
+    Aplica `lector` a cada elemento, en paralelo si workers > 1. El resultado conserva el orden
+    de entrada, así que la combinación posterior es determinista.
+    """
+    if not workers or workers <= 1 or len(elementos) <= 1:
+        return [lector(elemento) for elemento in elementos]
+    if modo == "hilos":
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(partial(lector, engine="pyarrow"), elementos))
+    if modo == "procesos":
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(lector, elementos))
+    raise ValueError(f"Modo de lectura desconocido: {modo}")
+
+@medir_etapa("carga CSV")
+def load_multiple_csvs(file_paths: list[str], workers: int | None = None, modo: str = "procesos") -> pd.DataFrame:
+    """
+    Con workers > 1 cada fichero se lee en un pool de procesos o, con modo="hilos", en un pool de
+    hilos con el lector de pyarrow. La deduplicación y el orden son los mismos que en serie.
+    """
+    dfs = _leer_en_paralelo(load_bitpanda_csv, file_paths, workers, modo)
+    return combinar_transacciones(dfs)
+
+# Lectura por trozos para exportaciones muy grandes
+COLUMNAS_CATEGORICAS = [
+    "Integration Name", "Label", "Outgoing Asset", "Incoming Asset",
+    "Fee Asset (optional)", "Source Type", "Source Name"
+]
+TAMAÑO_TROZO = 100_000
+TAMAÑO_LOTE_MEZCLA = 8_192
+_SIN_ID = "\0sin-id"  # Las filas sin Trx. ID se deduplican entre sí, igual que drop_duplicates
+
+def _trozos_csv(file_path: str, chunksize: int):
+    cabecera = pd.read_csv(file_path, sep=";", nrows=0).columns
+    nombres = {col: col.strip() for col in cabecera if col.strip() in COLUMNS}
+    dtype = {col: "category" for col, nombre in nombres.items() if nombre in COLUMNAS_CATEGORICAS}
+    dtype.update({col: str for col, nombre in nombres.items() if nombre == "Trx. ID (optional)"})
+    fecha = next((col for col, nombre in nombres.items() if nombre == "Date (UTC)"), None)
+    if fecha is None:
+        raise ValueError(f"{file_path}: falta la columna 'Date (UTC)'; ¿es una exportación de Bitpanda?")
+
+    for trozo in pd.read_csv(file_path, sep=";", usecols=list(nombres), dtype=dtype,
+                             parse_dates=[fecha], dayfirst=True, chunksize=chunksize):
+        yield trozo.rename(columns=nombres)[COLUMNS]
+
+def _escribir_tramo(trozo: pd.DataFrame, ruta: str, tamaño_lote: int):
+    tabla = pa.Table.from_pandas(trozo, preserve_index=False)
+    with pa.ipc.new_file(ruta, tabla.schema) as writer:
+        writer.write_table(tabla, max_chunksize=tamaño_lote)
+
+def _lotes_tramo(ruta: str):
+    with pa.memory_map(ruta) as fuente:
+        lector = pa.ipc.open_file(fuente)
+        for i in range(lector.num_record_batches):
+            yield lector.get_batch(i).to_pandas()
+
+def _mezclar_tramos(rutas: list[str]):
+    """
+    Mezcla k-aria por fecha de tramos ya ordenados, leyendo un lote de cada tramo a la vez.
+    """
+    lectores = [_lotes_tramo(ruta) for ruta in rutas]
+    buffers = [None] * len(rutas)
+    agotados = [False] * len(rutas)
+
+    while True:
+        for i, lector in enumerate(lectores):
+            while not agotados[i] and (buffers[i] is None or buffers[i].empty):
+                buffers[i] = next(lector, None)
+                agotados[i] = buffers[i] is None
+        activos = [i for i in range(len(rutas)) if buffers[i] is not None and not buffers[i].empty]
+        if not activos:
+            return
+
+        # Todo lo anterior a la última fecha del buffer más atrasado ya se puede emitir en orden
+        pendientes = [buffers[i]["Date (UTC)"].iloc[-1] for i in activos]
+        frontera = min(pendientes)
+
+        salida = []
+        for i in activos:
+            n = buffers[i]["Date (UTC)"].searchsorted(frontera, side="right")
+            if n:
+                salida.append(buffers[i].iloc[:n])
+                buffers[i] = buffers[i].iloc[n:]
+        yield _concatenar(salida).sort_values("Date (UTC)", kind="mergesort", ignore_index=True)
+
+def _concatenar(trozos: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatena conservando las columnas categóricas aunque cada trozo tenga categorías distintas.
+    """
+    columnas = {}
+    for columna in trozos[0].columns:
+        series = [trozo[columna] for trozo in trozos]
+        if all(isinstance(serie.dtype, pd.CategoricalDtype) for serie in series):
+            columnas[columna] = pd.api.types.union_categoricals(series, ignore_order=True)
+        else:
+            columnas[columna] = pd.concat(series, ignore_index=True)
+    return pd.DataFrame(columnas)
+
+def _hash_ids(ids) -> np.ndarray:
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+def iterar_transacciones_ordenadas(file_paths: list[str], chunksize: int = TAMAÑO_TROZO,
+                                   tamaño_lote: int = TAMAÑO_LOTE_MEZCLA):
+    """
+    Lee los CSV por trozos y devuelve las transacciones ordenadas por fecha en bloques, sin cargar
+    nunca todos los ficheros a la vez. Los duplicados por Trx. ID se eliminan a la salida de la
+    mezcla, ya en orden de fecha: como en combinar_transacciones, se conserva la aparición más
+    antigua. Lo único que crece con el historial es el array ordenado de hash de los IDs ya
+    emitidos (8 bytes por ID).
+    """
+    vistos = np.empty(0, dtype=np.uint64)
+    with tempfile.TemporaryDirectory() as directorio:
+        rutas = []
+        for path in file_paths:
+            for trozo in _trozos_csv(path, chunksize):
+                if trozo.empty:
+                    continue
+                ruta = os.path.join(directorio, f"tramo-{len(rutas)}.arrow")
+                _escribir_tramo(trozo.sort_values("Date (UTC)", kind="mergesort"), ruta, tamaño_lote)
+                rutas.append(ruta)
+
+        for bloque in _mezclar_tramos(rutas):
+            hashes = _hash_ids(bloque["Trx. ID (optional)"].fillna(_SIN_ID))
+            _, primeras = np.unique(hashes, return_index=True)
+            nuevos = np.zeros(len(bloque), dtype=bool)
+            nuevos[primeras] = True
+            if len(vistos):
+                posiciones = np.minimum(np.searchsorted(vistos, hashes), len(vistos) - 1)
+                nuevos &= vistos[posiciones] != hashes
+            vistos = np.union1d(vistos, hashes[nuevos])
+            if nuevos.any():
+                yield bloque[nuevos].reset_index(drop=True)
+
+def escribir_transacciones_ordenadas(file_paths: list[str], destino: str, chunksize: int = TAMAÑO_TROZO) -> int:
+    """
+    Escribe en `destino` (Parquet) las transacciones deduplicadas y ordenadas por fecha, bloque a
+    bloque: la memoria no depende del tamaño de los CSV. Devuelve el número de filas escritas.
+    """
+    escritor, filas = None, 0
+    try:
+        for bloque in iterar_transacciones_ordenadas(file_paths, chunksize):
+            tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+            if escritor is None:
+                # Las categorías cambian de un bloque a otro: se escriben como texto y Parquet las
+                # vuelve a codificar como diccionario
+                esquema = pa.schema([
+                    pa.field(campo.name, pa.string() if pa.types.is_dictionary(campo.type) or pa.types.is_null(campo.type)
+                             else campo.type) for campo in tabla.schema
+                ])
+                escritor = pq.ParquetWriter(destino, esquema)
+            escritor.write_table(tabla.cast(esquema))
+            filas += len(bloque)
+    finally:
+        if escritor is not None:
+            escritor.close()
+    return filas
+
+@medir_etapa("carga CSV por trozos")
+def load_multiple_csvs_streaming(file_paths: list[str], chunksize: int = TAMAÑO_TROZO) -> pd.DataFrame:
+    """
+    Alternativa a load_multiple_csvs para exportaciones muy grandes: lectura por trozos, tipos
+    compactos (categorías para activos y etiquetas) y mezcla externa por fecha. La lectura y la
+    mezcla tienen memoria acotada, pero el resultado es un DataFrame con todo el historial (se lee
+    de un Parquet temporal, sin tener a la vez los bloques y su concatenación). Para procesar sin
+    cargarlo todo, usar iterar_transacciones_ordenadas o escribir_transacciones_ordenadas.
+    """
+    with tempfile.TemporaryDirectory() as directorio:
+        destino = os.path.join(directorio, "transacciones.parquet")
+        if not escribir_transacciones_ordenadas(file_paths, destino, chunksize):
+            return pd.DataFrame(columns=COLUMNS)
+        return pq.read_table(destino, read_dictionary=COLUMNAS_CATEGORICAS).to_pandas()
+
+# Caché en Parquet de los CSV ya procesados, indexada por el hash de su contenido
+DIRECTORIO_CACHE = os.path.join("data", "cache")
+TAMAÑO_MAXIMO_CACHE = 512 * 1024 * 1024  # bytes
+VERSION_CACHE = "1"  # Cambiar si cambia el formato de las columnas cacheadas
+
+def hash_contenido(contenido: bytes) -> str:
+    return hashlib.sha256(contenido).hexdigest()
+
+def _leer_cache(ruta: str) -> pd.DataFrame | None:
+    if not os.path.exists(ruta):
+        return None
+    try:
+        df = pd.read_parquet(ruta)
+    except Exception:
+        return None
+    os.utime(ruta)  # Marca de uso reciente para la política LRU
+    return df
+
+def _escribir_cache(ruta: str, df: pd.DataFrame):
+    temporal = ruta + ".tmp"
+    try:
+        df.to_parquet(temporal)
+        os.replace(temporal, ruta)
+    except Exception:
+        # Columnas con tipos mezclados que Arrow no admite: se continúa sin caché
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+def limpiar_por_uso(directorio: str, tamaño_maximo: int, extension: str, desempate=None):
+    """
+    Elimina los ficheros `*extension` usados hace más tiempo (por fecha de modificación) hasta que
+    ocupen como mucho `tamaño_maximo` bytes. `desempate(nombre)`, si se pasa, decide el orden entre
+    ficheros con el mismo uso (se borra antes el menor). Otros hilos o procesos pueden estar
+    limpiando a la vez: las entradas que ya no existen se saltan.
+    """
+    try:
+        nombres = os.listdir(directorio)
+    except FileNotFoundError:
+        return
+    entradas = []
+    for nombre in nombres:
+        if nombre.endswith(extension):
+            try:
+                stat = os.stat(os.path.join(directorio, nombre))
+            except FileNotFoundError:
+                continue
+            orden = (stat.st_mtime, desempate(nombre) if desempate else nombre)
+            entradas.append((orden, stat.st_size, nombre))
+    total = sum(tamaño for _, tamaño, _ in entradas)
+    for _, tamaño, nombre in sorted(entradas):
+        if total <= tamaño_maximo:
+            break
+        try:
+            os.remove(os.path.join(directorio, nombre))
+        except FileNotFoundError:
+            pass
+        total -= tamaño
+
+def limpiar_cache(directorio: str = DIRECTORIO_CACHE, tamaño_maximo: int = TAMAÑO_MAXIMO_CACHE):
+    """
+    Elimina las entradas usadas hace más tiempo hasta que la caché ocupe como mucho `tamaño_maximo` bytes.
+    """
+    limpiar_por_uso(directorio, tamaño_maximo, ".parquet")
+
+def load_bitpanda_bytes(contenido: bytes, directorio: str = DIRECTORIO_CACHE, engine: str = "c") -> pd.DataFrame:
+    """
+    Como load_bitpanda_csv, pero a partir del contenido del fichero y usando la caché.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"csv-{VERSION_CACHE}-{hash_contenido(contenido)}.parquet")
+    df = _leer_cache(ruta)
+    if df is None:
+        df = load_bitpanda_csv(io.BytesIO(contenido), engine=engine)
+        _escribir_cache(ruta, df)
+    return df
+
+@medir_etapa("carga con caché")
+def load_cached_uploads(contenidos: list[bytes], directorio: str = DIRECTORIO_CACHE,
+                        tamaño_maximo: int = TAMAÑO_MAXIMO_CACHE,
+                        workers: int | None = None, modo: str = "hilos", compacto: bool = False) -> pd.DataFrame:
+    """
+    Carga, combina y preprocesa varios CSV subidos. Si el mismo conjunto de ficheros ya se
+    procesó antes, se lee directamente el resultado preprocesado desde Parquet.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    hashes = [hash_contenido(contenido) for contenido in contenidos]
+    # Las reglas de clasificación forman parte de la clave: tras registrar_regla se vuelve a preprocesar
+    clave = hashlib.sha256((huella_reglas() + "".join(hashes)).encode()).hexdigest()
+    modo_preprocesado = "compacto" if compacto else "normal"
+    ruta = os.path.join(directorio, f"preprocesado-{VERSION_CACHE}-{modo_preprocesado}-{clave}.parquet")
+
+    df = _leer_cache(ruta)
+    if df is None:
+        lector = partial(load_bitpanda_bytes, directorio=directorio)
+        dfs = _leer_en_paralelo(lector, contenidos, workers, modo)
+        df = preprocess_df(combinar_transacciones(dfs), compacto=compacto)
+        _escribir_cache(ruta, df)
+        limpiar_cache(directorio, tamaño_maximo)
+    return df
+
+# Reglas de clasificación en orden de prioridad: (texto contenido en Label, tipo de transacción)
+REGLAS_CLASIFICACION = [
+    ("trade", "Trade"),
+    ("deposit", "Deposit"),
+    ("withdrawal", "Withdrawal"),
+    ("staking", "Staking"),
+    ("auto balance", "Internal Transfer"),
+    ("non-taxable", "Non-taxable"),
+]
+TIPO_POR_DEFECTO = "Other"
+
+def registrar_regla(patron: str, tipo: str, posicion: int | None = None):
+    """
+    Añade una regla de clasificación. Por defecto se evalúa después de las existentes.
+    """
+    regla = (patron.lower(), tipo)
+    if posicion is None:
+        REGLAS_CLASIFICACION.append(regla)
+    else:
+        REGLAS_CLASIFICACION.insert(posicion, regla)
+
+def huella_reglas() -> str:
+    """
+    Huella de las reglas de clasificación vigentes, para las cachés de datos ya clasificados.
+    """
+    return hashlib.sha256(repr((REGLAS_CLASIFICACION, TIPO_POR_DEFECTO)).encode()).hexdigest()[:16]
+
+def tipos_de_transaccion() -> list[str]:
+    tipos = list(dict.fromkeys(tipo for _, tipo in REGLAS_CLASIFICACION))
+    if TIPO_POR_DEFECTO not in tipos:
+        tipos.append(TIPO_POR_DEFECTO)
+    return tipos
+
 def classify_transaction(row):
     label = row["Label"].lower()
-    if "trade" in label:
-        return "Trade"
-    elif "deposit" in label:
-        return "Deposit"
-    elif "withdrawal" in label:
-        return "Withdrawal"
-    elif "staking" in label:
-        return "Staking"
-    elif "auto balance" in label:
-        return "Internal Transfer"
-    elif "non-taxable" in label:
-        return "Non-taxable"
-    else:
-        return "Other"
+    for patron, tipo in REGLAS_CLASIFICACION:
+        if patron in label:
+            return tipo
+    return TIPO_POR_DEFECTO
+
+def clasificar_transacciones(labels: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de classify_transaction: aplica las reglas sobre los valores únicos
+    de Label y devuelve una columna categórica.
+    """
+    codigos, unicos = pd.factorize(labels)
+    unicos = pd.Series(unicos, dtype=object).str.lower()
+
+    condiciones = [unicos.str.contains(patron, regex=False, na=False).to_numpy() for patron, _ in REGLAS_CLASIFICACION]
+    tipos_unicos = np.select(condiciones, [tipo for _, tipo in REGLAS_CLASIFICACION], default=TIPO_POR_DEFECTO)
 
-def preprocess_df(df: pd.DataFrame) -> pd.DataFrame:
-    df["Transaction Type"] = df.apply(classify_transaction, axis=1)
-    df["Date (UTC)"] = pd.to_datetime(df["Date (UTC)"]).dt.date
+    tipos = np.append(tipos_unicos, TIPO_POR_DEFECTO)[codigos]  # código -1 (NaN) → tipo por defecto
+    return pd.Series(pd.Categorical(tipos, categories=tipos_de_transaccion()), index=labels.index)
+
+# Columnas que el modo compacto guarda como categóricas tras el preprocesado
+COLUMNAS_CATEGORICAS_PREPROCESADO = [
+    "Integration Name", "Outgoing Asset", "Incoming Asset", "Fee Asset (optional)", "Source Type", "Source Name"
+]
+
+@medir_etapa("preprocess_df")
+def preprocess_df(df: pd.DataFrame, compacto: bool = False) -> pd.DataFrame:
+    """
+    Clasifica las transacciones y normaliza fechas y comisiones (modifica `df`).
+
+    Con compacto=True los activos, la integración y las columnas de origen pasan a categóricas
+    y Date queda como datetime64 (a medianoche) en lugar de objetos `date` de Python.
+    Presupuesto de memoria medido con generador_sintetico (20 activos), por millón de filas:
+    ~500 MB en el modo normal frente a ~130 MB en el compacto.
+    """
+    df["Transaction Type"] = clasificar_transacciones(df["Label"])
+    if compacto:
+        df["Date (UTC)"] = pd.to_datetime(df["Date (UTC)"]).dt.normalize()
+        for columna in COLUMNAS_CATEGORICAS_PREPROCESADO:
+            if not isinstance(df[columna].dtype, pd.CategoricalDtype):
+                df[columna] = df[columna].astype("category")
+    else:
+        df["Date (UTC)"] = pd.to_datetime(df["Date (UTC)"]).dt.date
     
     # Reemplazar NaN en las columnas de Fee con 0
-    df["Fee Asset (optional)"].fillna("", inplace=True)
-    df["Fee Amount (optional)"].fillna(0, inplace=True)
+    fee_asset = df["Fee Asset (optional)"]
+    if isinstance(fee_asset.dtype, pd.CategoricalDtype) and "" not in fee_asset.cat.categories:
+        fee_asset = fee_asset.cat.add_categories("")
+    df["Fee Asset (optional)"] = fee_asset.fillna("")
+    df["Fee Amount (optional)"] = df["Fee Amount (optional)"].fillna(0)
     
     df.drop(columns=["Label"], inplace=True)
     df.rename(columns={"Date (UTC)": "Date"}, inplace=True)
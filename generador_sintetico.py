@@ -0,0 +1,129 @@
+# generador_sintetico.py
+#
+# Genera exportaciones sintéticas de Bitpanda con las columnas de data_loader.COLUMNS:
+#   python generador_sintetico.py salida/ --filas 100000 --activos 20 --ficheros 4
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from data_loader import COLUMNS
+
+# Peso relativo de cada tipo de operación
+MEZCLA_POR_DEFECTO = {
+    "compra": 0.45,     # Trade EUR -> cripto (DCA)
+    "venta": 0.20,      # Trade cripto -> EUR
+    "permuta": 0.08,    # Trade cripto -> cripto
+    "staking": 0.12,    # Staking reward
+    "deposito": 0.08,   # Deposit EUR
+    "retirada": 0.05,   # Non-taxable EUR -> banco
+    "transferencia": 0.02,  # Auto balance
+}
+
+ETIQUETAS = {
+    "compra": "Trade", "venta": "Trade", "permuta": "Trade", "staking": "Staking Reward",
+    "deposito": "Deposit", "retirada": "Non-Taxable", "transferencia": "Auto Balance",
+}
+
+def generar_ledger(filas: int, activos: int = 10, mezcla: dict[str, float] | None = None,
+                   tasa_duplicados: float = 0.0, años: int = 4, semilla: int = 0) -> pd.DataFrame:
+    """
+    Devuelve un DataFrame con `filas` transacciones (más los duplicados) y precios que siguen un
+    paseo aleatorio por activo. Las fechas ya vienen como texto con el día primero, como en Bitpanda.
+    """
+    rng = np.random.default_rng(semilla)
+    mezcla = mezcla or MEZCLA_POR_DEFECTO
+    tipos = np.array(list(mezcla))
+    pesos = np.array(list(mezcla.values()), dtype=float)
+    tipo = rng.choice(tipos, size=filas, p=pesos / pesos.sum())
+
+    inicio = pd.Timestamp("2021-01-01")
+    segundos = np.sort(rng.integers(0, años * 365 * 24 * 3600, size=filas))
+    fechas = inicio + pd.to_timedelta(segundos, unit="s")
+
+    nombres = np.array([f"C{i:03d}" for i in range(activos)])
+    activo = rng.integers(0, activos, size=filas)
+    otro = (activo + rng.integers(1, max(activos, 2), size=filas)) % max(activos, 1)
+
+    # Precio por activo y día: paseo aleatorio geométrico
+    dias = (segundos // 86400).astype(np.int64)
+    pasos = rng.normal(0, 0.03, size=(dias.max() + 1, activos))
+    precios = rng.uniform(0.5, 40000, size=activos) * np.exp(np.cumsum(pasos, axis=0))
+    precio = precios[dias, activo]
+    precio_otro = precios[dias, otro]
+
+    importe_eur = np.round(rng.lognormal(4, 1, size=filas), 2)
+    cantidad = importe_eur / precio
+
+    out_asset = np.full(filas, None, dtype=object)
+    out_amt = np.full(filas, np.nan)
+    in_asset = np.full(filas, None, dtype=object)
+    in_amt = np.full(filas, np.nan)
+
+    def asignar(tipo_operacion, oa, om, ia, im):
+        m = tipo == tipo_operacion
+        for destino, valor in ((out_asset, oa), (out_amt, om), (in_asset, ia), (in_amt, im)):
+            destino[m] = valor[m] if isinstance(valor, np.ndarray) else valor
+
+    principal, secundario = nombres[activo], nombres[otro]
+    asignar("compra", "EUR", importe_eur, principal, cantidad)
+    asignar("venta", principal, cantidad, "EUR", importe_eur)
+    asignar("permuta", principal, cantidad, secundario, importe_eur / precio_otro)
+    asignar("staking", None, np.nan, principal, cantidad * 0.01)
+    asignar("deposito", None, np.nan, "EUR", importe_eur * 10)
+    asignar("retirada", "EUR", importe_eur * 5, None, np.nan)
+    asignar("transferencia", principal, cantidad, principal, cantidad)
+
+    con_comision = np.isin(tipo, ["compra", "venta", "permuta"]) & (rng.random(filas) < 0.7)
+    df = pd.DataFrame({
+        "Date (UTC)": fechas.strftime("%d.%m.%Y %H:%M:%S"),
+        "Integration Name": "Bitpanda",
+        "Label": np.vectorize(ETIQUETAS.get)(tipo),
+        "Outgoing Asset": out_asset,
+        "Outgoing Amount": out_amt,
+        "Incoming Asset": in_asset,
+        "Incoming Amount": in_amt,
+        "Fee Asset (optional)": np.where(con_comision, "EUR", None),
+        "Fee Amount (optional)": np.where(con_comision, np.round(importe_eur * 0.015, 2), np.nan),
+        "Comment (optional)": None,
+        "Trx. ID (optional)": [f"trx-{semilla}-{i}" for i in range(filas)],
+        "Source Type": "exchange",
+        "Source Name": "Bitpanda",
+    })[COLUMNS]
+
+    if tasa_duplicados > 0:
+        duplicados = df.sample(frac=tasa_duplicados, random_state=semilla)
+        df = pd.concat([df, duplicados], ignore_index=True)
+    return df
+
+def escribir_csvs(df: pd.DataFrame, directorio: str, ficheros: int = 1) -> list[str]:
+    """
+    Reparte el ledger en `ficheros` CSV consecutivos (como varias exportaciones anuales).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    rutas = []
+    for i, parte in enumerate(np.array_split(np.arange(len(df)), ficheros)):
+        ruta = os.path.join(directorio, f"bitpanda_{i:02d}.csv")
+        df.iloc[parte].to_csv(ruta, sep=";", index=False)
+        rutas.append(ruta)
+    return rutas
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Generador de CSV sintéticos de Bitpanda.")
+    parser.add_argument("directorio")
+    parser.add_argument("--filas", type=int, default=10_000)
+    parser.add_argument("--activos", type=int, default=10)
+    parser.add_argument("--ficheros", type=int, default=1)
+    parser.add_argument("--duplicados", type=float, default=0.0, help="Fracción de filas repetidas")
+    parser.add_argument("--semilla", type=int, default=0)
+    for tipo, peso in MEZCLA_POR_DEFECTO.items():
+        parser.add_argument(f"--{tipo}", type=float, default=peso, help=f"Peso de {tipo} (por defecto {peso})")
+    args = parser.parse_args(argv)
+
+    mezcla = {tipo: getattr(args, tipo) for tipo in MEZCLA_POR_DEFECTO}
+    df = generar_ledger(args.filas, args.activos, mezcla, args.duplicados, semilla=args.semilla)
+    for ruta in escribir_csvs(df, args.directorio, args.ficheros):
+        print(ruta)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# instrumentacion.py
+
+import cProfile
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+# Cada hilo (cada sesión de Streamlit ejecuta su script en un hilo propio) tiene su registro
+_local = threading.local()
+MAX_REGISTROS = 1000
+
+def _registros() -> list[dict]:
+    if not hasattr(_local, "registros"):
+        _local.registros = []
+    return _local.registros
+
+def _rss() -> int | None:
+    """
+    Memoria residente del proceso en bytes (solo Linux; en otros sistemas devuelve None).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _filas(objeto) -> int | None:
+    if isinstance(objeto, tuple):
+        objeto = next((o for o in objeto if isinstance(o, pd.DataFrame)), None)
+    if isinstance(objeto, pd.DataFrame):
+        return len(objeto)
+    return None
+
+@contextmanager
+def etapa(nombre: str, filas_entrada: int | None = None):
+    """
+    Mide una etapa: tiempo, filas de entrada/salida y variación de memoria. Si tracemalloc está
+    activo se usa la memoria trazada (más precisa); si no, la memoria residente del proceso.
+    Quien la usa puede rellenar registro["filas_salida"] dentro del bloque.
+    """
+    trazando = tracemalloc.is_tracing()
+    memoria_inicial = tracemalloc.get_traced_memory()[0] if trazando else _rss()
+    registro = {"etapa": nombre, "filas_entrada": filas_entrada, "filas_salida": None}
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro["segundos"] = time.perf_counter() - inicio
+        memoria_final = tracemalloc.get_traced_memory()[0] if trazando else _rss()
+        registro["memoria_delta_bytes"] = (
+            memoria_final - memoria_inicial if memoria_inicial is not None and memoria_final is not None else None
+        )
+        registro["memoria"] = "tracemalloc" if trazando else "rss"
+        registros = _registros()
+        registros.append(registro)
+        del registros[:-MAX_REGISTROS]
+
+def medir_etapa(nombre: str | None = None):
+    """
+    Decorador que registra cada llamada como una etapa. Las filas se toman del primer
+    DataFrame de los argumentos y del resultado.
+    """
+    def decorador(funcion):
+        etiqueta = nombre or f"{funcion.__module__}.{funcion.__name__}"
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            entrada = next((a for a in args if isinstance(a, pd.DataFrame)), None)
+            with etapa(etiqueta, _filas(entrada)) as registro:
+                resultado = funcion(*args, **kwargs)
+                registro["filas_salida"] = _filas(resultado)
+            return resultado
+        return envoltura
+    return decorador
+
+def informe() -> pd.DataFrame:
+    """
+    Registros del hilo actual como tabla, en orden de finalización.
+    """
+    columnas = ["etapa", "segundos", "filas_entrada", "filas_salida", "memoria_delta_bytes", "memoria"]
+    return pd.DataFrame(_registros(), columns=columnas)
+
+def reiniciar():
+    _registros().clear()
+
+class Perfilador:
+    """
+    Perfil de CPU con cProfile y, opcionalmente, instantánea de memoria con tracemalloc.
+    Los volcados se guardan en `directorio` al detenerlo.
+    """
+
+    def __init__(self, directorio: str = os.path.join("data", "perfiles"), memoria: bool = True):
+        self.directorio = directorio
+        self.memoria = memoria
+        self._perfil = cProfile.Profile()
+        self._iniciar_tracemalloc = False
+
+    def iniciar(self) -> "Perfilador":
+        self._iniciar_tracemalloc = self.memoria and not tracemalloc.is_tracing()
+        if self._iniciar_tracemalloc:
+            tracemalloc.start()
+        self._perfil.enable()
+        return self
+
+    def detener(self) -> dict[str, str]:
+        self._perfil.disable()
+        os.makedirs(self.directorio, exist_ok=True)
+        base = os.path.join(self.directorio, datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+        rutas = {"cprofile": base + ".prof"}
+        self._perfil.dump_stats(rutas["cprofile"])
+        if self.memoria and tracemalloc.is_tracing():
+            rutas["tracemalloc"] = base + ".tracemalloc"
+            tracemalloc.take_snapshot().dump(rutas["tracemalloc"])
+        if self._iniciar_tracemalloc:
+            tracemalloc.stop()
+        return rutas
+
+@contextmanager
+def perfilar(directorio: str = os.path.join("data", "perfiles"), memoria: bool = True):
+    """
+    Ejecuta el bloque bajo un Perfilador. El diccionario devuelto recibe las rutas de los volcados al salir.
+    """
+    perfilador = Perfilador(directorio, memoria).iniciar()
+    rutas = {}
+    try:
+        yield rutas
+    finally:
+        rutas.update(perfilador.detener())
@@ -0,0 +1,171 @@
+# ledger.py
+
+import hashlib
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from data_loader import COLUMNS, _SIN_ID, _hash_ids
+
+DIRECTORIO_LEDGERS = os.path.join("data", "ledgers")
+# Con más segmentos en el registro de altas, se fusionan con la base en un único fichero
+MAX_SEGMENTOS = 16
+
+COLUMNAS_NUMERICAS = ["Outgoing Amount", "Incoming Amount", "Fee Amount (optional)"]
+ESQUEMA_LEDGER = pa.schema([
+    pa.field(columna, pa.timestamp("ns") if columna == "Date (UTC)"
+             else pa.float64() if columna in COLUMNAS_NUMERICAS else pa.string())
+    for columna in COLUMNS
+])
+
+def _a_tabla(df: pd.DataFrame) -> pa.Table:
+    columnas = {}
+    for campo in ESQUEMA_LEDGER:
+        serie = df[campo.name]
+        if pa.types.is_string(campo.type):
+            serie = serie.astype(object).where(serie.isna(), serie.astype(str))
+        columnas[campo.name] = pa.array(serie, type=campo.type, from_pandas=True)
+    return pa.table(columnas, schema=ESQUEMA_LEDGER)
+
+def _escribir_ipc(ruta: str, tabla: pa.Table):
+    # Sin compresión: así el fichero se puede abrir con memory map sin descomprimir
+    temporal = ruta + ".tmp"
+    with pa.OSFile(temporal, "wb") as f, pa.ipc.new_file(f, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    os.replace(temporal, ruta)
+
+def _leer_ipc(ruta: str) -> pa.Table:
+    return pa.ipc.open_file(pa.memory_map(ruta, "r")).read_all()
+
+def nombre_valido(usuario: str) -> str | None:
+    """
+    Nombre de usuario saneado, o None si queda vacío o solo tiene puntos ("." o "..").
+    """
+    nombre = re.sub(r"[^\w.-]", "_", usuario.strip())[:64]
+    if not nombre.strip("."):
+        return None
+    return nombre
+
+def ruta_ledger(usuario: str, clave: str, directorio: str = DIRECTORIO_LEDGERS) -> str:
+    """
+    Carpeta del ledger de un usuario. La app no tiene cuentas: la carpeta se deriva del usuario y de
+    una clave que solo conoce quien la eligió, así que conocer el nombre de otro no da acceso a su
+    historial. Lanza ValueError si el nombre o la clave no son válidos.
+    """
+    nombre = nombre_valido(usuario)
+    if nombre is None or not clave:
+        raise ValueError("Usuario o clave no válidos")
+    huella = hashlib.sha256(f"{nombre}\n{clave}".encode()).hexdigest()
+    base = os.path.realpath(directorio)
+    ruta = os.path.realpath(os.path.join(base, huella))
+    if os.path.commonpath([base, ruta]) != base or ruta == base:
+        raise ValueError("Ruta de ledger fuera de " + directorio)
+    return ruta
+
+class Ledger:
+    """
+    Historial de transacciones de un usuario en disco, en formato Arrow IPC (Feather v2):
+    base.arrow con el grueso del historial, un registro de altas (log/*.arrow, un segmento por
+    cada añadido) e ids.npy con los hash de los Trx. ID ordenados. Se abre con memory map, así que
+    reabrir años de historial no lee ni copia los datos hasta que se usan.
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self.ruta_base = os.path.join(directorio, "base.arrow")
+        self.ruta_log = os.path.join(directorio, "log")
+        self.ruta_ids = os.path.join(directorio, "ids.npy")
+
+    def _segmentos(self) -> list[str]:
+        # La carpeta se crea con el primer añadido: abrir un ledger que no existe no escribe nada
+        if not os.path.isdir(self.ruta_log):
+            return []
+        return sorted(os.path.join(self.ruta_log, f) for f in os.listdir(self.ruta_log) if f.endswith(".arrow"))
+
+    def _ficheros(self) -> list[str]:
+        base = [self.ruta_base] if os.path.exists(self.ruta_base) else []
+        return base + self._segmentos()
+
+    def ids(self) -> np.ndarray:
+        if not os.path.exists(self.ruta_ids):
+            return np.empty(0, dtype=np.uint64)
+        return np.load(self.ruta_ids, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids())
+
+    def huella(self) -> str:
+        """
+        Cambia cada vez que se añaden filas o se compacta: sirve de clave para cachés y trabajos.
+        """
+        partes = [f"{os.path.basename(r)}:{os.path.getsize(r)}:{os.path.getmtime(r)}" for r in self._ficheros()]
+        return hashlib.sha256("|".join([self.directorio] + partes).encode()).hexdigest()
+
+    def tabla(self) -> pa.Table:
+        """
+        Todas las transacciones como tabla Arrow sobre los ficheros mapeados en memoria.
+        """
+        tablas = [_leer_ipc(ruta) for ruta in self._ficheros()]
+        if not tablas:
+            return ESQUEMA_LEDGER.empty_table()
+        return pa.concat_tables(tablas)
+
+    def to_pandas(self, desde=None, hasta=None) -> pd.DataFrame:
+        """
+        Transacciones (opcionalmente solo las de un rango de fechas, ambos extremos incluidos) en el
+        mismo formato que load_bitpanda_csv. El filtro se aplica en Arrow, antes de copiar a pandas.
+        """
+        tabla = self.tabla()
+        fechas = tabla["Date (UTC)"]
+        if desde is not None:
+            tabla = tabla.filter(pc.greater_equal(fechas, pa.scalar(pd.Timestamp(desde), type=fechas.type)))
+            fechas = tabla["Date (UTC)"]
+        if hasta is not None:
+            tabla = tabla.filter(pc.less_equal(fechas, pa.scalar(pd.Timestamp(hasta), type=fechas.type)))
+        return tabla.to_pandas()
+
+    def añadir(self, df: pd.DataFrame) -> int:
+        """
+        Añade las filas cuyo Trx. ID aún no está en el ledger (las filas sin ID cuentan como un
+        mismo ID, igual que en combinar_transacciones). Devuelve el número de filas añadidas.
+        """
+        df = df.sort_values("Date (UTC)", kind="stable")
+        hashes = _hash_ids(df["Trx. ID (optional)"].fillna(_SIN_ID))
+        _, primeras = np.unique(hashes, return_index=True)
+        nuevas = np.zeros(len(df), dtype=bool)
+        nuevas[primeras] = True
+
+        existentes = self.ids()
+        if len(existentes):
+            posiciones = np.minimum(np.searchsorted(existentes, hashes), len(existentes) - 1)
+            nuevas &= existentes[posiciones] != hashes
+        if not nuevas.any():
+            return 0
+
+        os.makedirs(self.ruta_log, exist_ok=True)
+        segmento = os.path.join(self.ruta_log, f"{time.time_ns():020d}.arrow")
+        _escribir_ipc(segmento, _a_tabla(df[nuevas]))
+        ids = np.union1d(existentes, hashes[nuevas])
+        temporal = self.ruta_ids + ".tmp.npy"
+        np.save(temporal, ids)
+        os.replace(temporal, self.ruta_ids)
+
+        if len(self._segmentos()) > MAX_SEGMENTOS:
+            self.compactar()
+        return int(nuevas.sum())
+
+    def compactar(self):
+        """
+        Fusiona la base y el registro de altas en una nueva base ordenada por fecha.
+        """
+        segmentos = self._segmentos()
+        if not segmentos:
+            return
+        tabla = self.tabla()
+        tabla = tabla.take(pc.sort_indices(tabla, [("Date (UTC)", "ascending")]))
+        _escribir_ipc(self.ruta_base, tabla)
+        for ruta in segmentos:
+            os.remove(ruta)
@@ -0,0 +1,229 @@
+# lots.py
+
+import heapq
+import numpy as np
+import pandas as pd
+
+
+class ColaLotes:
+    """
+    Cola FIFO de lotes de un activo guardada en arrays planos (cantidad, precio unitario, fecha).
+    Funciona como buffer circular: consumir un lote solo avanza el índice de cabeza (o, con
+    DESDE_EL_FINAL, retrocede el final, que es el orden LIFO de PilaLotes).
+    """
+    DESDE_EL_FINAL = False
+
+    def __init__(self, capacidad: int = 16):
+        self.cantidad = np.zeros(capacidad, dtype=np.float64)
+        self.precio_unitario = np.zeros(capacidad, dtype=np.float64)
+        self.fecha = np.empty(capacidad, dtype=object)
+        self.cabeza = 0
+        self.tamaño = 0
+
+    def __len__(self):
+        return self.tamaño
+
+    def _crecer(self):
+        capacidad = len(self.cantidad)
+        orden = (self.cabeza + np.arange(self.tamaño)) % capacidad
+        nueva = capacidad * 2
+        for nombre in ("cantidad", "precio_unitario", "fecha"):
+            actual = getattr(self, nombre)
+            ampliado = np.empty(nueva, dtype=actual.dtype)
+            ampliado[:self.tamaño] = actual[orden]
+            setattr(self, nombre, ampliado)
+        self.cabeza = 0
+
+    def agregar(self, cantidad: float, precio_unitario: float, fecha):
+        if self.tamaño == len(self.cantidad):
+            self._crecer()
+        i = (self.cabeza + self.tamaño) % len(self.cantidad)
+        self.cantidad[i] = cantidad
+        self.precio_unitario[i] = precio_unitario
+        self.fecha[i] = fecha
+        self.tamaño += 1
+
+    def consumir(self, cantidad_a_vender: float) -> tuple[float, float]:
+        """
+        Consume lotes desde el más antiguo (o el más reciente). Devuelve (cantidad vendida, coste total).
+        """
+        cantidad_vendida = 0.0
+        coste_total = 0.0
+        capacidad = len(self.cantidad)
+        desde_el_final = self.DESDE_EL_FINAL
+
+        while cantidad_a_vender > 0 and self.tamaño:
+            i = (self.cabeza + self.tamaño - 1) % capacidad if desde_el_final else self.cabeza
+            cantidad_disponible = float(self.cantidad[i])
+            precio = float(self.precio_unitario[i])
+
+            if cantidad_disponible <= cantidad_a_vender:
+                cantidad_vendida += cantidad_disponible
+                coste_total += cantidad_disponible * precio
+                cantidad_a_vender -= cantidad_disponible
+                self.fecha[i] = None
+                if not desde_el_final:
+                    self.cabeza = (i + 1) % capacidad
+                self.tamaño -= 1
+            else:
+                cantidad_vendida += cantidad_a_vender
+                coste_total += cantidad_a_vender * precio
+                self.cantidad[i] = cantidad_disponible - cantidad_a_vender
+                cantidad_a_vender = 0
+
+        return cantidad_vendida, coste_total
+
+    def estado(self) -> dict:
+        """
+        Lotes abiertos (del más antiguo al más reciente) en un formato serializable.
+        """
+        orden = (self.cabeza + np.arange(self.tamaño)) % len(self.cantidad)
+        return {
+            "cantidad": self.cantidad[orden],
+            "precio_unitario": self.precio_unitario[orden],
+            "fecha": self.fecha[orden],
+        }
+
+    @classmethod
+    def desde_estado(cls, estado: dict) -> "ColaLotes":
+        tamaño = len(estado["cantidad"])
+        cola = cls(max(16, tamaño))
+        cola.cantidad[:tamaño] = estado["cantidad"]
+        cola.precio_unitario[:tamaño] = estado["precio_unitario"]
+        cola.fecha[:tamaño] = estado["fecha"]
+        cola.tamaño = tamaño
+        return cola
+
+
+class PilaLotes(ColaLotes):
+    """
+    Lotes en orden LIFO: se consume primero el lote más reciente.
+    """
+    DESDE_EL_FINAL = True
+
+
+class LotesEspecificos(ColaLotes):
+    """
+    Identificación específica: cada venta consume primero los lotes indicados por su fecha de
+    adquisición (en el orden dado) y, si no bastan, el resto en orden FIFO.
+    """
+
+    def consumir(self, cantidad_a_vender: float, lotes=()) -> tuple[float, float]:
+        cantidad_vendida = 0.0
+        coste_total = 0.0
+        if lotes and self.tamaño:
+            orden = (self.cabeza + np.arange(self.tamaño)) % len(self.cantidad)
+            fechas = [pd.Timestamp(fecha) for fecha in self.fecha[orden]]
+            for lote in lotes:
+                for i, fecha in zip(orden, fechas):
+                    if cantidad_a_vender <= 0:
+                        break
+                    if fecha != lote:
+                        continue
+                    cantidad = min(float(self.cantidad[i]), cantidad_a_vender)
+                    cantidad_vendida += cantidad
+                    coste_total += cantidad * float(self.precio_unitario[i])
+                    self.cantidad[i] -= cantidad
+                    cantidad_a_vender -= cantidad
+            self._quitar_vacios(orden)
+
+        resto_vendido, resto_coste = super().consumir(cantidad_a_vender)
+        return cantidad_vendida + resto_vendido, coste_total + resto_coste
+
+    def _quitar_vacios(self, orden: np.ndarray):
+        # Los lotes agotados pueden quedar en medio de la cola: se compacta conservando el orden
+        vivos = orden[self.cantidad[orden] > 0]
+        if len(vivos) == self.tamaño:
+            return
+        for nombre in ("cantidad", "precio_unitario", "fecha"):
+            actual = getattr(self, nombre)
+            compactado = np.empty(len(actual), dtype=actual.dtype)
+            compactado[:len(vivos)] = actual[vivos]
+            setattr(self, nombre, compactado)
+        self.cabeza = 0
+        self.tamaño = len(vivos)
+
+
+class MonticuloLotes:
+    """
+    Lotes en orden HIFO: se consume primero el lote de mayor precio unitario (montículo por precio;
+    a igual precio, el más antiguo).
+    """
+
+    def __init__(self):
+        self._lotes = []  # [-precio unitario, orden de llegada, cantidad, fecha]
+        self._llegadas = 0
+
+    def __len__(self):
+        return len(self._lotes)
+
+    def agregar(self, cantidad: float, precio_unitario: float, fecha):
+        heapq.heappush(self._lotes, [-precio_unitario, self._llegadas, cantidad, fecha])
+        self._llegadas += 1
+
+    def consumir(self, cantidad_a_vender: float) -> tuple[float, float]:
+        cantidad_vendida = 0.0
+        coste_total = 0.0
+
+        while cantidad_a_vender > 0 and self._lotes:
+            lote = self._lotes[0]
+            cantidad_disponible, precio = lote[2], -lote[0]
+
+            if cantidad_disponible <= cantidad_a_vender:
+                cantidad_vendida += cantidad_disponible
+                coste_total += cantidad_disponible * precio
+                cantidad_a_vender -= cantidad_disponible
+                heapq.heappop(self._lotes)
+            else:
+                # La clave del montículo (precio, llegada) no cambia: basta con actualizar la cantidad
+                cantidad_vendida += cantidad_a_vender
+                coste_total += cantidad_a_vender * precio
+                lote[2] = cantidad_disponible - cantidad_a_vender
+                cantidad_a_vender = 0
+
+        return cantidad_vendida, coste_total
+
+
+class CosteMedio:
+    """
+    Coste medio ponderado: en lugar de lotes se guardan las sumas de cantidad y coste, y cada venta
+    sale al coste medio del saldo en ese momento.
+    """
+
+    def __init__(self):
+        self.cantidad = 0.0
+        self.coste = 0.0
+
+    def __len__(self):
+        return int(self.cantidad > 0)
+
+    def agregar(self, cantidad: float, precio_unitario: float, fecha):
+        self.cantidad += cantidad
+        self.coste += cantidad * precio_unitario
+
+    def consumir(self, cantidad_a_vender: float) -> tuple[float, float]:
+        if cantidad_a_vender <= 0 or self.cantidad <= 0:
+            return 0.0, 0.0
+        if cantidad_a_vender >= self.cantidad:
+            cantidad_vendida, coste_total = self.cantidad, self.coste
+            self.cantidad = self.coste = 0.0
+        else:
+            cantidad_vendida = cantidad_a_vender
+            coste_total = self.coste * (cantidad_a_vender / self.cantidad)
+            self.cantidad -= cantidad_a_vender
+            self.coste -= coste_total
+        return cantidad_vendida, coste_total
+
+
+# Métodos de cálculo del coste de adquisición: cada uno es una estructura de lotes con
+# agregar(cantidad, precio_unitario, fecha) y consumir(cantidad) -> (cantidad vendida, coste)
+METODOS_COSTE = {
+    "FIFO": ColaLotes,
+    "LIFO": PilaLotes,
+    "HIFO": MonticuloLotes,
+    "Coste medio": CosteMedio,
+    "Lotes específicos": LotesEspecificos,
+}
+
+# Métodos cuyas ventas aceptan la selección de lotes: consumir(cantidad, lotes)
+METODOS_CON_SELECCION = {"Lotes específicos"}
@@ -1,14 +1,21 @@
 # main.py
 
 import streamlit as st
-from data_loader import load_multiple_csvs, preprocess_df
-from processor import calcular_plusvalias_fifo
-from visualizer import mostrar_resumen
-from tax_utils import calcular_impuestos, resumen_fiscal, filtrar_plusvalias_sobre_retiradas
+from data_loader import hash_contenido, load_bitpanda_bytes, combinar_transacciones
+from processor import construir_cubo, resumen_por_cripto, comparar_metodos
+from visualizer import mostrar_resumen, mostrar_tabla_paginada, mostrar_rendimiento, mostrar_progreso_trabajo
+from instrumentacion import Perfilador, etapa, informe, reiniciar
+from consultas import ConsultaTabla
+from almacen import AlmacenTransacciones
+from tax_utils import filtrar_plusvalias_sobre_retiradas, declaracion_del_año
+from trabajos import GestorTrabajos, PENDIENTE, TERMINADO, ERROR
+from pipeline import procesar_subidas, procesar_ledger, ETAPAS_SUBIDAS
+from ledger import Ledger, ruta_ledger, nombre_valido
+from precios import cargar_precios, huella_precios
 from datetime import datetime
 import os
-from st_aggrid import AgGrid
-from st_aggrid.grid_options_builder import GridOptionsBuilder
+import time
+from functools import partial
 import pandas as pd
 
 
@@ -16,154 +23,273 @@ import pandas as pd
 st.set_page_config(page_title="🪙 Crypto Tax Analyzer - España", layout="wide")
 st.title("🪙 Crypto Tax Analyzer - Declaración de la Renta (España)")
 
-uploaded_files = st.file_uploader(
-    "Sube tus CSVs de Bitpanda",
-    type="csv",
-    accept_multiple_files=True
-)
+# Las etapas pesadas se memorizan por hash de los ficheros y parámetros: los cambios que solo
+# afectan a la vista (filtros, tablas) no vuelven a cargar ni a recalcular nada.
+CACHE_MAX_ENTRADAS = 8
+CACHE_TTL = 60 * 60  # segundos
 
-if uploaded_files:
+INTERVALO_SONDEO = 1.0  # segundos entre comprobaciones del trabajo en segundo plano
+
+# Las subidas se procesan en un pool de hilos: la sesión no se bloquea y, si el usuario interactúa
+# mientras tanto, el trabajo sigue en marcha (los envíos repetidos se deduplican por contenido)
+@st.cache_resource
+def gestor_trabajos() -> GestorTrabajos:
+    return GestorTrabajos(procesar_subidas, ETAPAS_SUBIDAS)
+
+# Precios locales (data/precios) para valorar permutas, staking y comisiones en cripto: se cargan
+# una vez por versión de los ficheros y el almacén, con su caché de consultas, se comparte
+@st.cache_resource(max_entries=2, show_spinner="Cargando precios...")
+def precios_locales(huella: str | None):
+    return cargar_precios() if huella else None
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner=False)
+def archivar_subidas(hashes: tuple[str, ...], _archivos: list[tuple[str, bytes]]):
     # Crear carpeta 'data' y subcarpeta con la fecha actual
     today = datetime.now().strftime("%Y-%m-%d")
     data_dir = os.path.join("data", today)
     os.makedirs(data_dir, exist_ok=True)
 
     # Guardar archivos en la carpeta correspondiente
-    temp_paths = []
-    for file in uploaded_files:
-        file_path = os.path.join(data_dir, file.name)
-        with open(file_path, "wb") as f:
-            f.write(file.getbuffer())
-            temp_paths.append(file_path)
-
-    # Procesar datos
-    df_raw = load_multiple_csvs(temp_paths)
-    df = preprocess_df(df_raw)
-    df = resumen_fiscal(df)
-    
-    # Selección del año fiscal
-    st.subheader("📆 Año Fiscal")
-    año_fiscal = st.selectbox("Selecciona el año fiscal a declarar", [2022, 2023, 2024, 2025], index=2)
-    fecha_corte = datetime(año_fiscal, 12, 31).date()
-
-    # Asegurar que la columna Date es tipo datetime
-    df = df[df["Date"] <= fecha_corte]
-
-    st.success(f"{len(df)} transacciones cargadas.")
-    st.subheader("📋 Vista preliminar de tus transacciones")
-    # Agregar filtros para cada columna utilizando Ag-Grid
-
-    # Configurar opciones de la tabla interactiva
-    gb = GridOptionsBuilder.from_dataframe(df)
-    gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
-    gb.configure_side_bar()  # Barra lateral para filtros avanzados
-
-    grid_options = gb.build()
-
-    # Mostrar tabla interactiva
-    grid_response = AgGrid(
-        df,
-        gridOptions=grid_options,
-        enable_enterprise_modules=True,
-        theme="streamlit",  # Cambiar tema si es necesario
-        height=400,
-        fit_columns_on_grid_load=True
+    for nombre, contenido in _archivos:
+        with open(os.path.join(data_dir, nombre), "wb") as f:
+            f.write(contenido)
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner="Añadiendo al historial...")
+def añadir_al_ledger(directorio: str, hashes: tuple[str, ...], _archivos: list[tuple[str, bytes]]) -> int:
+    nuevas = [load_bitpanda_bytes(contenido) for _, contenido in _archivos]
+    return Ledger(directorio).añadir(combinar_transacciones(nuevas))
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner="Cargando transacciones...")
+def cargar_transacciones(trabajo: str) -> pd.DataFrame:
+    return gestor_trabajos().resultado(trabajo, "transacciones")
+
+# El almacén ordena e indexa las transacciones una vez por conjunto de ficheros; cada año fiscal
+# es un recorte por búsqueda binaria que comparte esos datos
+@st.cache_resource(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL)
+def almacen_transacciones(trabajo: str) -> AlmacenTransacciones:
+    return AlmacenTransacciones(cargar_transacciones(trabajo))
+
+# Una sola pasada FIFO sobre todo el historial sirve para todos los años: el motor es causal, así que
+# las ventas hasta el 31 de diciembre de un año no dependen de las transacciones posteriores
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner="Cargando plusvalías...")
+def calcular_historial(trabajo: str):
+    gestor = gestor_trabajos()
+    return gestor.resultado(trabajo, "plusvalias"), gestor.resultado(trabajo, "informe")
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner="Preparando el año fiscal...")
+def calcular_año_fiscal(trabajo: str, año_fiscal: int):
+    fecha_corte = datetime(año_fiscal, 12, 31)
+    almacen = almacen_transacciones(trabajo).recortar(fecha_corte)
+    df = almacen.df
+
+    historial, _ = calcular_historial(trabajo)
+    resultados = AlmacenTransacciones(historial, "Fecha", claves=()).rango(hasta=fecha_corte)
+    cubo = construir_cubo(resultados)
+    retiradas_df, total_retiradas, cantidad_total_retiradas = filtrar_plusvalias_sobre_retiradas(almacen, resultados)
+    # Misma regla que el informe de todos los años: cada venta se declara una sola vez
+    declaracion = declaracion_del_año(almacen, resultados, año_fiscal)
+    return df, resultados, cubo, retiradas_df, total_retiradas, cantidad_total_retiradas, declaracion
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL, show_spinner="Comparando métodos de coste...")
+def comparar_metodos_año(trabajo: str, año_fiscal: int) -> pd.DataFrame:
+    df = almacen_transacciones(trabajo).recortar(datetime(año_fiscal, 12, 31)).df
+    return comparar_metodos(df, desde=datetime(año_fiscal, 1, 1), precios=precios_locales(huella_precios()))
+
+# Las tablas Arrow son inmutables: se comparten entre ejecuciones sin copiarlas
+@st.cache_resource(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL)
+def tabla_transacciones(trabajo: str, año_fiscal: int, _df: pd.DataFrame) -> ConsultaTabla:
+    return ConsultaTabla(_df)
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL)
+def tabla_resultados(trabajo: str, año_fiscal: int, _resultados: pd.DataFrame) -> ConsultaTabla:
+    return ConsultaTabla(_resultados)
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL)
+def almacen_resultados(trabajo: str, año_fiscal: int, _resultados: pd.DataFrame) -> AlmacenTransacciones:
+    return AlmacenTransacciones(_resultados, "Fecha", claves=("Cripto",))
+
+def invalidar_cache(trabajo: str):
+    gestor_trabajos().descartar(trabajo)
+    cargar_transacciones.clear()
+    almacen_transacciones.clear()
+    calcular_historial.clear()
+    calcular_año_fiscal.clear()
+    comparar_metodos_año.clear()
+    tabla_transacciones.clear()
+    tabla_resultados.clear()
+    almacen_resultados.clear()
+
+# Instrumentación: cada ejecución del script empieza con un informe de tiempos vacío. El perfilador
+# se detiene pase lo que pase (st.rerun y st.stop también salen con una excepción)
+reiniciar()
+perfilador = None
+estado_trabajo = None
+if st.sidebar.checkbox("🔬 Perfilar esta ejecución", help="Guarda un volcado de cProfile y tracemalloc en data/perfiles"):
+    perfilador = Perfilador().iniciar()
+rutas_perfil = None
+try:
+    uploaded_files = st.file_uploader(
+        "Sube tus CSVs de Bitpanda",
+        type="csv",
+        accept_multiple_files=True
     )
-    
-    # Obtener datos filtrados desde la tabla interactiva
-    filtered_df = pd.DataFrame(grid_response["data"])
-
-    # Calcular totales para las columnas numéricas después de aplicar el filtro
-    totals = filtered_df.select_dtypes(include='number').sum()
-    totals_row = pd.DataFrame([totals], columns=totals.index)
-    totals_row = totals_row.reindex(columns=filtered_df.columns, fill_value="-")  # Asegurar que coincidan las columnas
-
-    # Agregar la fila de totales al DataFrame filtrado
-    filtered_df_with_totals = pd.concat([totals_row], ignore_index=True)
-
-    # Extraer y mostrar los totales de "Outgoing amount" e "Incoming amount"
-    outgoing_total = filtered_df["Outgoing Amount"].sum() if "Outgoing Amount" in filtered_df else 0
-    incoming_total = filtered_df["Incoming Amount"].sum() if "Incoming Amount" in filtered_df else 0
-
-    # Mostrar los totales en un formato más visual
-    col1, col2 = st.columns(2)
-    with col1:
-        st.metric(label="Filtered Outgoing amount", value=f"{outgoing_total:,.2f} €")
-    with col2:
-        st.metric(label="Filtered Incoming amount", value=f"{incoming_total:,.2f} €")
-
-    # Obtener datos filtrados desde la tabla interactiva
-    filtered_df = grid_response["data"]
-
-    # Calcular plusvalías
-    st.divider()
-    st.subheader("💹 Cálculo de Ganancias y Pérdidas (FIFO)")
-    resultados = calcular_plusvalias_fifo(df)
-    
-    
-    mostrar_resumen(resultados)
-
-    # Calcular plusvalías asociadas a retiradas (Non-taxable Outgoing EUR)
-    st.subheader("Plusvalías relacionadas con retiradas a cuenta bancaria")
-
-    retiradas_df, total_retiradas, cantidad_total_retiradas = filtrar_plusvalias_sobre_retiradas(df, resultados)
-
-    if not retiradas_df.empty:
-
-        # Resumen por moneda
-        resumen_moneda = resultados.groupby("Cripto").agg({
-            "Cantidad vendida": "sum",
-            "Ingreso EUR": "sum",
-            "Coste EUR (FIFO)": "sum",
-            "Ganancia/pérdida EUR": "sum",
-            "Comisión": "sum"
-        }).reset_index()
-
-        resumen_moneda["Precio medio venta"] = resumen_moneda["Ingreso EUR"] / resumen_moneda["Cantidad vendida"]
-        resumen_moneda["Precio medio compra"] = resumen_moneda["Coste EUR (FIFO)"] / resumen_moneda["Cantidad vendida"]
-
-        col1, col2, col3 = st.columns([5, 0.2, 2])
+
+    # Ledger por usuario: las subidas se añaden a su historial en disco y las siguientes sesiones
+    # lo reabren sin volver a subir ni a leer los CSV. La app no tiene cuentas: el historial solo se
+    # protege con la clave (la carpeta se deriva de usuario y clave), así que sin clave no hay ledger.
+    usuario = nombre_valido(st.sidebar.text_input("👤 Usuario", help="Guarda tu historial en el servidor"))
+    clave_ledger = st.sidebar.text_input("🔑 Clave del historial", type="password",
+                                         help="Necesaria para guardar y reabrir tu historial; no se puede recuperar")
+    ledger = Ledger(ruta_ledger(usuario, clave_ledger)) if usuario and clave_ledger else None
+
+    if uploaded_files or (ledger is not None and len(ledger)):
+        archivos = [(file.name, file.getvalue()) for file in uploaded_files or []]
+        hashes = tuple(hash_contenido(contenido) for _, contenido in archivos)
+        if archivos:
+            archivar_subidas(hashes, archivos)
+
+        # Envío al gestor de trabajos: mientras no termina, la página muestra el progreso y sondea
+        gestor = gestor_trabajos()
+        # Los precios forman parte de la clave del trabajo: al cambiarlos se recalcula
+        huella = huella_precios()
+        precios = precios_locales(huella)
+        clave_precios = ("precios", huella) if huella else ()
+        if ledger is not None:
+            if archivos:
+                nuevas = añadir_al_ledger(ledger.directorio, hashes, archivos)
+                st.sidebar.caption(f"{nuevas} transacciones nuevas añadidas al historial de {usuario}.")
+            st.sidebar.caption(f"Historial de {usuario}: {len(ledger)} transacciones.")
+            enviar = partial(gestor.enviar, [], ("ledger", ledger.huella()) + clave_precios,
+                             funcion=partial(procesar_ledger, ledger.directorio, precios=precios))
+        else:
+            enviar = partial(gestor.enviar, [contenido for _, contenido in archivos], hashes + clave_precios,
+                             funcion=partial(procesar_subidas, precios=precios))
+        trabajo = enviar()
+        estado_trabajo = gestor.estado(trabajo)
+        if estado_trabajo is None:
+            # Otra sesión lo ha descartado o la limpieza lo ha borrado tras el envío: se vuelve a
+            # enviar y, si tampoco está, se muestra como pendiente hasta la siguiente comprobación
+            trabajo = enviar()
+            estado_trabajo = gestor.estado(trabajo) or {
+                "id": trabajo, "estado": PENDIENTE, "etapa": None, "progreso": 0.0, "etapas": [], "error": None,
+            }
+        st.sidebar.button("🔄 Recalcular", on_click=invalidar_cache, args=(trabajo,),
+                          help="Descarta los resultados memorizados y vuelve a procesar los ficheros")
+        with st.sidebar.expander("🗂️ Trabajo actual"):
+            st.caption(f"Estado: {estado_trabajo['estado']}")
+            st.dataframe(pd.DataFrame(estado_trabajo["etapas"]), use_container_width=True, hide_index=True)
+        if estado_trabajo["estado"] != TERMINADO:
+            mostrar_progreso_trabajo(estado_trabajo)
+            if estado_trabajo["estado"] != ERROR:
+                time.sleep(INTERVALO_SONDEO)
+                st.rerun()
+            st.stop()
+
+        # Selección del año fiscal
+        st.subheader("📆 Año Fiscal")
+        año_fiscal = st.selectbox("Selecciona el año fiscal a declarar", [2022, 2023, 2024, 2025], index=2)
+
+        if st.toggle("📚 Ver todos los años", help="Declaración de cada año calculada en una sola pasada sobre todo el historial"):
+            with etapa("informe plurianual (memorizado)"):
+                _, informe_años = calcular_historial(trabajo)
+            st.dataframe(informe_años, use_container_width=True, hide_index=True)
+            st.download_button("Descargar informe (CSV)", informe_años.to_csv(sep=";", index=False).encode("utf-8"),
+                               file_name="informe_plurianual.csv", mime="text/csv")
+
+        with etapa("cálculo del año fiscal (memorizado)"):
+            (df, resultados, cubo, retiradas_df, total_retiradas, cantidad_total_retiradas,
+             declaracion) = calcular_año_fiscal(trabajo, año_fiscal)
+
+        st.success(f"{len(df)} transacciones cargadas.")
+        st.subheader("📋 Vista preliminar de tus transacciones")
+        # Agregar filtros para cada columna utilizando Ag-Grid
+
+        # Tabla paginada en el servidor: los totales se calculan sin enviar todas las filas al navegador
+        filtrada = mostrar_tabla_paginada(
+            tabla_transacciones(trabajo, año_fiscal, df), "transacciones",
+            ["Transaction Type", "Outgoing Asset", "Incoming Asset"], columna_fecha="Date"
+        )
+        totales = filtrada.totales(["Outgoing Amount", "Incoming Amount"])
+
+        # Extraer y mostrar los totales de "Outgoing amount" e "Incoming amount"
+        outgoing_total = totales["Outgoing Amount"]
+        incoming_total = totales["Incoming Amount"]
+
+        # Mostrar los totales en un formato más visual
+        col1, col2 = st.columns(2)
         with col1:
-            # Configurar opciones de la tabla interactiva
-            gb = GridOptionsBuilder.from_dataframe(resumen_moneda.round(2))
-            gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
-            gb.configure_side_bar()  # Barra lateral para filtros avanzados
-
-            grid_options = gb.build()
-
-            # Mostrar tabla interactiva
-            grid_response = AgGrid(
-                resumen_moneda.round(2),
-                gridOptions=grid_options,
-                enable_enterprise_modules=True,
-                theme="streamlit",  # Cambiar tema si es necesario
-                height=400,
-                fit_columns_on_grid_load=True
-            )
-        with col3:
-            ganancia_retirada = retiradas_df["Ganancia/pérdida EUR"].sum()
-            st.metric(label="Ganancia por retiradas a declarar", value=f"{ganancia_retirada:,.2f} €")
-            st.metric(label="Número total de retiradas", value=f"{total_retiradas}")         
-            st.metric(label="Cantidad total retirada", value=f"{cantidad_total_retiradas:,.2f} €")
+            st.metric(label="Filtered Outgoing amount", value=f"{outgoing_total:,.2f} €")
+        with col2:
+            st.metric(label="Filtered Incoming amount", value=f"{incoming_total:,.2f} €")
+
+        # Calcular plusvalías
+        st.divider()
+        st.subheader("💹 Cálculo de Ganancias y Pérdidas (FIFO)")
+        if st.toggle("⚖️ Comparar métodos de coste", help="Ventas del año con FIFO, LIFO, HIFO y coste medio, en una sola pasada"):
+            st.dataframe(comparar_metodos_año(trabajo, año_fiscal), use_container_width=True, hide_index=True)
+        mostrar_resumen(resultados, cubo, tabla_resultados(trabajo, año_fiscal, resultados),
+                        almacen_resultados(trabajo, año_fiscal, resultados), clave=(trabajo, año_fiscal))
+
+        # Calcular plusvalías asociadas a retiradas (Non-taxable Outgoing EUR)
+        st.subheader("Plusvalías relacionadas con retiradas a cuenta bancaria")
+
+        if not retiradas_df.empty:
+
+            # Resumen por moneda
+            resumen_moneda = resumen_por_cripto(cubo)[[
+                "Cripto", "Cantidad vendida", "Ingreso EUR", "Coste EUR (FIFO)", "Ganancia/pérdida EUR", "Comisión"
+            ]]
+
+            resumen_moneda["Precio medio venta"] = resumen_moneda["Ingreso EUR"] / resumen_moneda["Cantidad vendida"]
+            resumen_moneda["Precio medio compra"] = resumen_moneda["Coste EUR (FIFO)"] / resumen_moneda["Cantidad vendida"]
+
+            col1, col2, col3 = st.columns([5, 0.2, 2])
+            with col1:
+                # Configurar opciones de la tabla interactiva (st_aggrid solo se carga si hay retiradas)
+                from st_aggrid import AgGrid, GridOptionsBuilder
+                gb = GridOptionsBuilder.from_dataframe(resumen_moneda.round(2))
+                gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
+                gb.configure_side_bar()  # Barra lateral para filtros avanzados
+
+                grid_options = gb.build()
+
+                # Mostrar tabla interactiva
+                grid_response = AgGrid(
+                    resumen_moneda.round(2),
+                    gridOptions=grid_options,
+                    enable_enterprise_modules=True,
+                    theme="streamlit",  # Cambiar tema si es necesario
+                    height=400,
+                    fit_columns_on_grid_load=True
+                )
+            with col3:
+                ganancia_retirada = declaracion["Ganancia neta a declarar EUR"]
+                st.metric(label="Ganancia por retiradas a declarar", value=f"{ganancia_retirada:,.2f} €")
+                st.metric(label="Número total de retiradas", value=f"{total_retiradas}")         
+                st.metric(label="Cantidad total retirada", value=f"{cantidad_total_retiradas:,.2f} €")
+        else:
+            st.info("No se han detectado retiradas a cuenta bancaria asociadas a ventas previas.")
+
+        # Calcular lo que se debe declarar y pagar
+        st.divider()
+        st.subheader("📄 Declaración y Pago de Impuestos")
+
+        # Ventas hasta la última retirada del año que no se declararon en años anteriores
+        ganancia_neta = declaracion["Ganancia neta a declarar EUR"]
+        impuestos_a_pagar = declaracion["Impuestos a pagar EUR"]
+
+        # Mostrar resultados
+        st.metric(label="Ganancia Neta a Declarar", value=f"{ganancia_neta:,.2f} €")
+        st.metric(label="Impuestos a Pagar", value=f"{impuestos_a_pagar:,.2f} €")
+
+        # Footer
+        st.markdown("---")
+        st.caption("🛠️ Desarrollado para ayudarte con tu declaración de la renta 🇪🇸")
+
     else:
-        st.info("No se han detectado retiradas a cuenta bancaria asociadas a ventas previas.")
-    
-    # Calcular lo que se debe declarar y pagar
-    st.divider()
-    st.subheader("📄 Declaración y Pago de Impuestos")
-
-    # Supongamos que `resultados` contiene una columna "Ganancia Neta"
-    ganancia_neta = retiradas_df["Ganancia/pérdida EUR"].sum()
-
-    impuestos_a_pagar = calcular_impuestos(ganancia_neta)
-
-    # Mostrar resultados
-    st.metric(label="Ganancia Neta a Declarar", value=f"{ganancia_neta:,.2f} €")
-    st.metric(label="Impuestos a Pagar", value=f"{impuestos_a_pagar:,.2f} €")
-    
-    # Footer
-    st.markdown("---")
-    st.caption("🛠️ Desarrollado para ayudarte con tu declaración de la renta 🇪🇸")
-
-else:
-    st.info("👈 Sube uno o más archivos CSV exportados desde Bitpanda.")
+        st.info("👈 Sube uno o más archivos CSV exportados desde Bitpanda (o indica tu usuario y clave para reabrir tu historial).")
+finally:
+    if perfilador:
+        rutas_perfil = perfilador.detener()
+
+mostrar_rendimiento(informe(), rutas_perfil, pd.DataFrame((estado_trabajo or {}).get("rendimiento") or []))
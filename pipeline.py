@@ -0,0 +1,116 @@
+# pipeline.py
+
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from data_loader import load_multiple_csvs, load_multiple_csvs_streaming, preprocess_df, load_cached_uploads, combinar_transacciones
+from ledger import Ledger
+from precios import AlmacenPrecios
+from almacen import AlmacenTransacciones
+from processor import calcular_plusvalias_fifo, calcular_plusvalias_fifo_incremental
+from tax_utils import resumen_fiscal, filtrar_plusvalias_sobre_retiradas, informe_plurianual, declaracion_del_año
+
+def _cargar(file_paths: list[str], por_trozos: bool) -> pd.DataFrame:
+    # Por trozos: lectura y deduplicación con memoria acotada, para exportaciones muy grandes
+    return load_multiple_csvs_streaming(file_paths) if por_trozos else load_multiple_csvs(file_paths)
+
+def ejecutar_pipeline(file_paths: list[str], año_fiscal: int,
+                      precios: AlmacenPrecios | None = None, por_trozos: bool = False) -> tuple[dict, dict]:
+    """
+    Ejecuta las mismas etapas que la app (carga, preprocesado, FIFO, retiradas e impuestos)
+    sin ninguna dependencia de interfaz. Devuelve (resultado, tiempos por etapa en segundos).
+    Con `precios` se valoran a mercado las permutas, el staking y las comisiones en cripto.
+    """
+    tiempos = {}
+
+    inicio = time.perf_counter()
+    df = _cargar(file_paths, por_trozos)
+    tiempos["carga"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    df = resumen_fiscal(preprocess_df(df, compacto=True))
+    almacen = AlmacenTransacciones(df).recortar(datetime(año_fiscal, 12, 31))
+    df = almacen.df
+    tiempos["preprocesado"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resultados = calcular_plusvalias_fifo(df, precios)
+    tiempos["fifo"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    _, total_retiradas, cantidad_total_retiradas = filtrar_plusvalias_sobre_retiradas(almacen, resultados)
+    declaracion = declaracion_del_año(almacen, resultados, año_fiscal)
+    ganancia_neta = declaracion["Ganancia neta a declarar EUR"]
+    impuestos = declaracion["Impuestos a pagar EUR"]
+    tiempos["impuestos"] = time.perf_counter() - inicio
+
+    resumen = {
+        "Año fiscal": año_fiscal,
+        "Transacciones": len(df),
+        "Operaciones": len(resultados),
+        "Ganancia/pérdida total EUR": float(resultados["Ganancia/pérdida EUR"].sum()),
+        "Número de retiradas": int(total_retiradas),
+        "Cantidad retirada EUR": float(cantidad_total_retiradas),
+        "Ganancia neta a declarar EUR": float(ganancia_neta),
+        "Impuestos a pagar EUR": float(impuestos),
+    }
+    return {"resumen": resumen, "plusvalias": resultados}, tiempos
+
+def ejecutar_informe_plurianual(file_paths: list[str], años: list[int] | None = None,
+                                precios: AlmacenPrecios | None = None, por_trozos: bool = False) -> tuple[dict, dict]:
+    """
+    Igual que ejecutar_pipeline pero para todos los años a la vez: una sola pasada FIFO sobre
+    todo el historial. Devuelve ({"informe", "plusvalias"}, tiempos por etapa en segundos).
+    """
+    tiempos = {}
+
+    inicio = time.perf_counter()
+    df = _cargar(file_paths, por_trozos)
+    tiempos["carga"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    almacen = AlmacenTransacciones(resumen_fiscal(preprocess_df(df, compacto=True)))
+    tiempos["preprocesado"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resultados = calcular_plusvalias_fifo(almacen.df, precios)
+    tiempos["fifo"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    informe = informe_plurianual(almacen, resultados, años)
+    tiempos["impuestos"] = time.perf_counter() - inicio
+
+    return {"informe": informe, "plusvalias": resultados}, tiempos
+
+# Etapas de procesar_subidas, en orden, para informar del progreso
+ETAPAS_SUBIDAS = ["carga", "FIFO", "informe"]
+
+def procesar_subidas(contenidos: list[bytes], progreso=lambda etapa: None,
+                     precios: AlmacenPrecios | None = None) -> dict[str, pd.DataFrame]:
+    """
+    Trabajo en segundo plano de la app: carga las subidas (con la caché en disco), calcula el
+    historial FIFO completo y el informe de todos los años. Llama a progreso(etapa) en cada etapa.
+    """
+    progreso("carga")
+    df = load_cached_uploads(contenidos, workers=os.cpu_count(), compacto=True)
+    return _procesar_historial(df, progreso, precios)
+
+def procesar_ledger(directorio: str, contenidos: list[bytes], progreso=lambda etapa: None,
+                    precios: AlmacenPrecios | None = None) -> dict[str, pd.DataFrame]:
+    """
+    Como procesar_subidas, pero leyendo el historial guardado en un Ledger (`contenidos` no se usa).
+    """
+    progreso("carga")
+    df = preprocess_df(combinar_transacciones([Ledger(directorio).to_pandas()]), compacto=True)
+    return _procesar_historial(df, progreso, precios)
+
+def _procesar_historial(df: pd.DataFrame, progreso, precios: AlmacenPrecios | None) -> dict[str, pd.DataFrame]:
+    almacen = AlmacenTransacciones(resumen_fiscal(df))
+
+    progreso("FIFO")
+    resultados = calcular_plusvalias_fifo_incremental(almacen.df, precios=precios)
+
+    progreso("informe")
+    informe = informe_plurianual(almacen, resultados)
+    return {"transacciones": almacen.df, "plusvalias": resultados, "informe": informe}
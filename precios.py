@@ -0,0 +1,147 @@
+# precios.py
+#
+# Precios históricos en EUR desde ficheros locales (CSV con ";" o Parquet) con las columnas
+# Activo, Fecha y Precio EUR, por ejemplo:
+#   Activo;Fecha;Precio EUR
+#   BTC;2024-01-01;38000.5
+
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+DIRECTORIO_PRECIOS = os.path.join("data", "precios")
+COLUMNAS_PRECIOS = ["Activo", "Fecha", "Precio EUR"]
+# Nombres alternativos habituales en las exportaciones de precios
+ALIAS_COLUMNAS = {
+    "asset": "Activo", "symbol": "Activo", "date": "Fecha", "timestamp": "Fecha",
+    "price_eur": "Precio EUR", "close": "Precio EUR", "price": "Precio EUR",
+}
+# Un precio se da por válido hasta esta antigüedad respecto a la fecha que se valora
+TOLERANCIA_POR_DEFECTO = pd.Timedelta(days=7)
+MAX_ENTRADAS_CACHE = 100_000
+_NS_POR_DIA = 86_400 * 10**9
+
+def _leer_fichero(ruta: str) -> pd.DataFrame:
+    if ruta.endswith(".parquet"):
+        df = pd.read_parquet(ruta)
+    else:
+        df = pd.read_csv(ruta, sep=";")
+    df.columns = [ALIAS_COLUMNAS.get(c.strip().lower(), c.strip()) for c in df.columns]
+    faltan = [c for c in COLUMNAS_PRECIOS if c not in df.columns]
+    if faltan:
+        raise ValueError(f"{ruta}: faltan las columnas {faltan}")
+    return df[COLUMNAS_PRECIOS]
+
+def ficheros_precios(directorio: str = DIRECTORIO_PRECIOS) -> list[str]:
+    return sorted(glob.glob(os.path.join(directorio, "*.csv")) + glob.glob(os.path.join(directorio, "*.parquet")))
+
+def huella_precios(directorio: str = DIRECTORIO_PRECIOS) -> str | None:
+    """
+    Cambia al añadir, quitar o modificar ficheros de precios; None si no hay ninguno.
+    """
+    rutas = ficheros_precios(directorio)
+    if not rutas:
+        return None
+    partes = [f"{os.path.basename(r)}:{os.path.getsize(r)}:{os.path.getmtime(r)}" for r in rutas]
+    return hashlib.sha256("|".join(partes).encode()).hexdigest()
+
+def cargar_precios(directorio: str = DIRECTORIO_PRECIOS, **kwargs) -> "AlmacenPrecios | None":
+    """
+    Almacén con los precios del directorio, o None si no hay ficheros (se mantiene la valoración
+    sin precios de mercado).
+    """
+    rutas = ficheros_precios(directorio)
+    return AlmacenPrecios.desde_ficheros(rutas, **kwargs) if rutas else None
+
+class AlmacenPrecios:
+    """
+    Precios indexados por activo y ordenados por fecha. Las valoraciones se hacen por lotes con un
+    único merge_asof (el último precio conocido en cada fecha) y los pares (activo, día) ya
+    consultados se guardan en una caché LRU con un máximo de entradas.
+    """
+
+    def __init__(self, precios: pd.DataFrame, tolerancia: pd.Timedelta = TOLERANCIA_POR_DEFECTO,
+                 max_entradas_cache: int = MAX_ENTRADAS_CACHE):
+        precios = precios.dropna(subset=COLUMNAS_PRECIOS).assign(
+            Activo=lambda d: d["Activo"].astype(str),
+            Fecha=lambda d: pd.to_datetime(d["Fecha"]).astype("datetime64[ns]"),
+            **{"Precio EUR": lambda d: d["Precio EUR"].astype(np.float64)},
+        )
+        self.precios = precios.sort_values("Fecha", kind="stable").drop_duplicates(["Activo", "Fecha"], keep="last")
+        self.activos = set(self.precios["Activo"].unique())
+        self.tolerancia = tolerancia
+        self.max_entradas_cache = max_entradas_cache
+        self._cache = OrderedDict()
+        # El almacén se comparte entre hilos (trabajos en segundo plano y sesiones de la app)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_ficheros(cls, rutas: list[str], **kwargs) -> "AlmacenPrecios":
+        if not rutas:
+            return cls(pd.DataFrame(columns=COLUMNAS_PRECIOS), **kwargs)
+        return cls(pd.concat([_leer_fichero(ruta) for ruta in rutas], ignore_index=True), **kwargs)
+
+    @classmethod
+    def desde_directorio(cls, directorio: str = DIRECTORIO_PRECIOS, **kwargs) -> "AlmacenPrecios":
+        return cls.desde_ficheros(ficheros_precios(directorio), **kwargs)
+
+    def __len__(self):
+        return len(self.precios)
+
+    def _consultar(self, activos: np.ndarray, dias: np.ndarray) -> np.ndarray:
+        consultas = pd.DataFrame({"Activo": activos, "Fecha": dias}).sort_values("Fecha", kind="stable")
+        unidas = pd.merge_asof(consultas, self.precios, on="Fecha", by="Activo",
+                               direction="backward", tolerance=self.tolerancia)
+        resultado = np.empty(len(activos))
+        resultado[consultas.index.to_numpy()] = unidas["Precio EUR"].to_numpy(dtype=np.float64)
+        return resultado
+
+    def valorar(self, activos, fechas) -> np.ndarray:
+        """
+        Precio en EUR de cada (activo, fecha): 1 para EUR y NaN si no hay precio dentro de la
+        tolerancia. Se consultan solo los pares (activo, día) distintos que no están en la caché.
+        """
+        activos = pd.Series(activos, dtype=object).to_numpy()
+        dias = pd.to_datetime(pd.Series(fechas)).dt.normalize().to_numpy(dtype="datetime64[ns]")
+        precios = np.full(len(activos), np.nan)
+        precios[activos == "EUR"] = 1.0
+        # Sin fecha no hay precio (NaT tendría código -1 al factorizar y apuntaría a otro par)
+        consultar = pd.Series(activos).isin(self.activos).to_numpy() & ~np.isnat(dias)
+        if not consultar.any():
+            return precios
+
+        # Pares (activo, día) distintos a partir de los códigos de cada columna, sin crear tuplas por fila
+        cod_activo, activos_unicos = pd.factorize(activos[consultar])
+        cod_dia, dias_unicos = pd.factorize(dias[consultar])
+        pares, codigos = np.unique(cod_activo.astype(np.int64) * len(dias_unicos) + cod_dia, return_inverse=True)
+        pares_activo = activos_unicos[pares // len(dias_unicos)]
+        pares_dia = dias_unicos[pares % len(dias_unicos)]
+
+        # Claves de la caché: (activo, día como entero), más baratas de comparar que un datetime64
+        claves = list(zip(pares_activo.tolist(), (pares_dia.view(np.int64) // _NS_POR_DIA).tolist()))
+        valores = np.empty(len(pares))
+        faltan = []
+        with self._lock:
+            for k, clave in enumerate(claves):
+                valor = self._cache.get(clave)
+                if valor is None:
+                    faltan.append(k)
+                else:
+                    valores[k] = valor
+                    self._cache.move_to_end(clave)
+
+        if faltan:
+            # La consulta se hace fuera del lock: otro hilo puede añadir los mismos pares, sin efecto
+            faltan = np.array(faltan)
+            valores[faltan] = self._consultar(pares_activo[faltan], pares_dia[faltan])
+            with self._lock:
+                self._cache.update(zip([claves[k] for k in faltan], valores[faltan].tolist()))
+                while len(self._cache) > self.max_entradas_cache:
+                    self._cache.popitem(last=False)
+
+        precios[consultar] = valores[codigos]
+        return precios
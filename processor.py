@@ -1,5 +1,16 @@
 import pandas as pd
+import numpy as np
 from collections import defaultdict
+from lots import ColaLotes, METODOS_COSTE, METODOS_CON_SELECCION
+import snapshots
+from instrumentacion import medir_etapa
+
+COLUMNAS_RESULTADO = [
+    "Fecha", "Cripto", "Cantidad vendida", "Ingreso EUR",
+    "Coste EUR (FIFO)", "Ganancia/pérdida EUR", "Comisión"
+]
+# Las mismas columnas para cualquier método de coste (calcular_plusvalias_metodos)
+COLUMNAS_METODOS = [columna.replace("Coste EUR (FIFO)", "Coste EUR") for columna in COLUMNAS_RESULTADO]
 
 def safe_float(x):
     try:
@@ -7,105 +18,314 @@ def safe_float(x):
     except:
         return 0.0
 
-def calcular_plusvalias_fifo(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df_trades = df[df["Transaction Type"] == "Trade"].sort_values("Date")
+def _columna_float(df: pd.DataFrame, columna: str) -> np.ndarray:
+    if columna not in df.columns:
+        return np.zeros(len(df), dtype=np.float64)
+    serie = df[columna]
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.fromiter((safe_float(x) for x in serie), dtype=np.float64, count=len(serie))
+
+def _columnas_trades(df: pd.DataFrame, precios=None) -> dict:
+    """
+    Extrae las operaciones de tipo Trade, ordenadas por fecha, como arrays NumPy. La ordenación
+    es estable para que el resultado hasta una fecha no dependa de las transacciones posteriores.
+    Con `precios` (un AlmacenPrecios) se incluyen también las recompensas de Staking y se valoran
+    en EUR, en un único lote, las dos patas de cada operación y las comisiones en otra moneda.
+    """
+    tipos = ["Trade", "Staking"] if precios is not None else ["Trade"]
+    df_trades = df.loc[df["Transaction Type"].isin(tipos), [
+        c for c in ("Date", "Transaction Type", "Outgoing Asset", "Outgoing Amount", "Incoming Asset",
+                    "Incoming Amount", "Fee Asset (optional)", "Fee Amount (optional)") if c in df.columns
+    ]].sort_values("Date", kind="stable")
+
+    fecha = df_trades["Date"].to_numpy()
+    out_asset = df_trades["Outgoing Asset"].to_numpy(dtype=object)
+    in_asset = df_trades["Incoming Asset"].to_numpy(dtype=object)
+    out_amt = _columna_float(df_trades, "Outgoing Amount")
+    in_amt = _columna_float(df_trades, "Incoming Amount")
+    fee = _columna_float(df_trades, "Fee Amount (optional)")
+    n = len(df_trades)
+    precio_out = precio_in = np.full(n, np.nan)
+    if precios is not None and n:
+        if "Fee Asset (optional)" in df_trades.columns:
+            fee_asset = df_trades["Fee Asset (optional)"].to_numpy(dtype=object)
+        else:
+            fee_asset = np.full(n, None, dtype=object)
+        valores = precios.valorar(np.concatenate((out_asset, in_asset, fee_asset)), np.tile(fecha, 3))
+        precio_out, precio_in, precio_fee = valores[:n], valores[n:2 * n], valores[2 * n:]
+        # Comisiones en cripto: se pasan a EUR; sin precio se mantiene el importe original
+        fee = np.where(np.isnan(precio_fee), fee, fee * precio_fee)
+
+    # Valor de mercado de la operación: lo entregado o, si no tiene precio, lo recibido
+    valor_out = out_amt * precio_out
+    return {
+        "fecha": fecha,
+        "out_asset": out_asset,
+        "in_asset": in_asset,
+        "out_valido": pd.notna(out_asset),
+        "in_valido": pd.notna(in_asset),
+        "out_amt": out_amt,
+        "in_amt": in_amt,
+        "fee": fee,
+        "staking": (df_trades["Transaction Type"] == "Staking").to_numpy(dtype=bool),
+        "precio_in": precio_in,
+        "valor_eur": np.where(np.isnan(valor_out), in_amt * precio_in, valor_out),
+    }
 
-    wallets = defaultdict(list)
-    resultados = []
+def _procesar_trades(cols: dict, inicio: int, fin: int, carteras: list[dict], resultados: list[dict],
+                     selecciones: list[dict | None] | None = None):
+    """
+    Aplica las operaciones [inicio, fin) sobre las carteras y añade las ventas a `resultados`.
+    Cada par (carteras[k], resultados[k]) es un método de coste: todos se evalúan en la misma pasada.
+    selecciones[k], si no es None, indica los lotes de cada venta: {(activo, fecha venta): [fecha lote, ...]}.
+    """
+    fecha, out_asset, in_asset = cols["fecha"], cols["out_asset"], cols["in_asset"]
+    out_valido, in_valido = cols["out_valido"], cols["in_valido"]
+    out_amt, in_amt, fee = cols["out_amt"], cols["in_amt"], cols["fee"]
+    staking, precio_in, valor_eur = cols["staking"], cols["precio_in"], cols["valor_eur"]
+    # Se guardan los append de cada columna para no buscarlos en el diccionario en cada venta
+    selecciones = selecciones or [None] * len(carteras)
+    metodos = [(wallets, seleccion, [res[columna].append for columna in COLUMNAS_RESULTADO])
+               for wallets, res, seleccion in zip(carteras, resultados, selecciones)]
 
-    for _, row in df_trades.iterrows():
-        out_asset = row["Outgoing Asset"]
-        in_asset = row["Incoming Asset"]
-        out_amt = safe_float(row["Outgoing Amount"])
-        in_amt = safe_float(row["Incoming Amount"])
-        fee = safe_float(row.get("Fee Amount (optional)", 0.0))
-        date = row["Date"]
+    for i in range(inicio, fin):
+        a_out = out_asset[i]
+        a_in = in_asset[i]
+        cant_out = float(out_amt[i])
+        cant_in = float(in_amt[i])
+        comision = float(fee[i])
+        date = fecha[i]
 
         # COMPRA → EUR -> Cripto
-        if out_asset == "EUR" and pd.notna(in_asset):
-            price_per_unit = out_amt / in_amt if in_amt else 0
-            wallets[in_asset].append({
-                "cantidad": in_amt,
-                "precio_unitario": price_per_unit,
-                "fecha": date
-            })
+        if a_out == "EUR" and in_valido[i]:
+            price_per_unit = cant_out / cant_in if cant_in else 0
+            for wallets, _, _ in metodos:
+                wallets[a_in].agregar(cant_in, price_per_unit, date)
+            continue
 
         # VENTA → Cripto -> EUR
-        elif in_asset == "EUR" and pd.notna(out_asset):
-            cantidad_a_vender = out_amt
-            ingreso_total = in_amt - fee
-            cantidad_vendida = 0.0
-            coste_total = 0.0
-
-            while cantidad_a_vender > 0 and wallets[out_asset]:
-                entrada = wallets[out_asset][0]
-                cantidad_disponible = entrada["cantidad"]
-
-                if cantidad_disponible <= cantidad_a_vender:
-                    cantidad_vendida += cantidad_disponible
-                    coste_total += cantidad_disponible * entrada["precio_unitario"]
-                    cantidad_a_vender -= cantidad_disponible
-                    wallets[out_asset].pop(0)
-                else:
-                    cantidad_vendida += cantidad_a_vender
-                    coste_total += cantidad_a_vender * entrada["precio_unitario"]
-                    entrada["cantidad"] -= cantidad_a_vender
-                    cantidad_a_vender = 0
-
-            ganancia = ingreso_total - coste_total
-
-            resultados.append({
-                "Fecha": date,
-                "Cripto": out_asset,
-                "Cantidad vendida": cantidad_vendida,
-                "Ingreso EUR": ingreso_total,
-                "Coste EUR (FIFO)": coste_total,
-                "Ganancia/pérdida EUR": ganancia,
-                "Comisión": fee
-            })
-
+        venta = a_in == "EUR" and out_valido[i]
         # PERMUTA → Cripto A -> Cripto B (también se considera venta)
-        elif pd.notna(out_asset) and pd.notna(in_asset) and out_asset != "EUR" and in_asset != "EUR":
-            cantidad_a_vender = out_amt
-            valor_adquisicion = 0.0
-            cantidad_vendida = 0.0
-
-            while cantidad_a_vender > 0 and wallets[out_asset]:
-                entrada = wallets[out_asset][0]
-                cantidad_disponible = entrada["cantidad"]
-
-                if cantidad_disponible <= cantidad_a_vender:
-                    cantidad_vendida += cantidad_disponible
-                    valor_adquisicion += cantidad_disponible * entrada["precio_unitario"]
-                    cantidad_a_vender -= cantidad_disponible
-                    wallets[out_asset].pop(0)
-                else:
-                    cantidad_vendida += cantidad_a_vender
-                    valor_adquisicion += cantidad_a_vender * entrada["precio_unitario"]
-                    entrada["cantidad"] -= cantidad_a_vender
-                    cantidad_a_vender = 0
-
-            # Precio de compra estimado de la cripto recibida
-            precio_unitario_compra = valor_adquisicion / in_amt if in_amt else 0
-
-            # Registrar la nueva cripto como comprada
-            wallets[in_asset].append({
-                "cantidad": in_amt,
-                "precio_unitario": precio_unitario_compra,
-                "fecha": date
-            })
-
-            resultados.append({
-                "Fecha": date,
-                "Cripto": out_asset,
-                "Cantidad vendida": cantidad_vendida,
-                "Ingreso EUR": valor_adquisicion,
-                "Coste EUR (FIFO)": valor_adquisicion,
-                "Ganancia/pérdida EUR": 0.0,  # neutra fiscalmente, pero se refleja la venta
-                "Comisión": fee
-            })
-
-    return pd.DataFrame(resultados)
+        permuta = not venta and out_valido[i] and in_valido[i] and a_out != "EUR" and a_in != "EUR"
+        if not (venta or permuta):
+            # STAKING → la recompensa entra en cartera a su valor de mercado (solo si tiene precio)
+            if staking[i] and in_valido[i] and cant_in and precio_in[i] == precio_in[i]:
+                for wallets, _, _ in metodos:
+                    wallets[a_in].agregar(cant_in, float(precio_in[i]), date)
+            continue
+
+        # Permuta con precio conocido: se valora a mercado como una venta seguida de una compra
+        valor = float(valor_eur[i]) if permuta else cant_in
+        valorada = venta or valor == valor
+        ingreso_total = valor - comision
+        for wallets, seleccion, (a_fecha, a_cripto, a_cantidad, a_ingreso, a_coste, a_ganancia, a_comision) in metodos:
+            if seleccion is None:
+                cantidad_vendida, coste_total = wallets[a_out].consumir(cant_out)
+            else:
+                lotes = seleccion.get((a_out, pd.Timestamp(date)), ())
+                cantidad_vendida, coste_total = wallets[a_out].consumir(cant_out, lotes)
+            if permuta:
+                # Sin precio, la cripto recibida hereda el valor de adquisición de la entregada
+                coste_recibida = valor if valorada else coste_total
+                wallets[a_in].agregar(cant_in, coste_recibida / cant_in if cant_in else 0, date)
+
+            a_fecha(date)
+            a_cripto(a_out)
+            a_cantidad(cantidad_vendida)
+            a_ingreso(ingreso_total if valorada else coste_total)
+            a_coste(coste_total)
+            # Sin precio la permuta es neutra fiscalmente, pero se refleja la venta
+            a_ganancia(ingreso_total - coste_total if valorada else 0.0)
+            a_comision(comision)
+
+def _normalizar_seleccion(seleccion_lotes: dict) -> dict:
+    return {
+        (activo, pd.Timestamp(fecha_venta)): [pd.Timestamp(fecha) for fecha in lotes]
+        for (activo, fecha_venta), lotes in seleccion_lotes.items()
+    }
+
+def calcular_plusvalias_metodos(df: pd.DataFrame, metodos=("FIFO",), precios=None,
+                                seleccion_lotes: dict | None = None,
+                                columnas: list[str] = COLUMNAS_METODOS) -> dict[str, pd.DataFrame]:
+    """
+    Plusvalías con varios métodos de coste (claves de METODOS_COSTE) en una sola pasada sobre las
+    operaciones. Las tablas tienen las columnas `columnas` (por defecto COLUMNAS_METODOS, donde
+    "Coste EUR" es el coste según cada método). Con `precios` (un AlmacenPrecios) se valoran a
+    mercado las permutas, el staking y las comisiones en cripto.
+    `seleccion_lotes` ({(activo, fecha venta): [fecha de adquisición, ...]}) indica qué lotes
+    consume cada venta con "Lotes específicos"; las ventas sin selección siguen el orden FIFO.
+    """
+    cols = _columnas_trades(df, precios)
+    carteras = [defaultdict(METODOS_COSTE[metodo]) for metodo in metodos]
+    resultados = [{columna: [] for columna in COLUMNAS_RESULTADO} for _ in metodos]
+    seleccion = _normalizar_seleccion(seleccion_lotes or {})
+    selecciones = [seleccion if metodo in METODOS_CON_SELECCION else None for metodo in metodos]
+
+    _procesar_trades(cols, 0, len(cols["fecha"]), carteras, resultados, selecciones)
+
+    return {metodo: pd.DataFrame(dict(zip(columnas, res.values())), columns=columnas)
+            for metodo, res in zip(metodos, resultados)}
+
+def calcular_plusvalias(df: pd.DataFrame, metodo: str = "FIFO", precios=None,
+                        seleccion_lotes: dict | None = None) -> pd.DataFrame:
+    return calcular_plusvalias_metodos(df, (metodo,), precios, seleccion_lotes)[metodo]
+
+@medir_etapa("FIFO")
+def calcular_plusvalias_fifo(df: pd.DataFrame, precios=None) -> pd.DataFrame:
+    return calcular_plusvalias_metodos(df, ("FIFO",), precios, columnas=COLUMNAS_RESULTADO)["FIFO"]
+
+@medir_etapa("comparación de métodos")
+def comparar_metodos(df: pd.DataFrame, metodos=None, desde=None, precios=None,
+                     seleccion_lotes: dict | None = None) -> pd.DataFrame:
+    """
+    Totales por método de coste, calculados en una única pasada. Con `desde` solo se suman las
+    ventas a partir de esa fecha (los lotes se siguen formando con todo el historial). Por defecto
+    se comparan todos los métodos; "Lotes específicos" solo si se pasa `seleccion_lotes`.
+    """
+    if metodos is None:
+        metodos = tuple(m for m in METODOS_COSTE if seleccion_lotes or m not in METODOS_CON_SELECCION)
+    filas = []
+    for metodo, resultados in calcular_plusvalias_metodos(df, metodos, precios, seleccion_lotes).items():
+        if desde is not None:
+            resultados = resultados[pd.to_datetime(resultados["Fecha"]) >= pd.Timestamp(desde)]
+        filas.append({
+            "Método": metodo,
+            "Operaciones": len(resultados),
+            "Ingreso EUR": resultados["Ingreso EUR"].sum(),
+            "Coste EUR": resultados["Coste EUR"].sum(),
+            "Ganancia/pérdida EUR": resultados["Ganancia/pérdida EUR"].sum(),
+        })
+    return pd.DataFrame(filas)
+
+@medir_etapa("FIFO incremental")
+def calcular_plusvalias_fifo_incremental(df: pd.DataFrame, directorio: str = snapshots.DIRECTORIO_SNAPSHOTS,
+                                         precios=None,
+                                         tamaño_maximo: int = snapshots.TAMAÑO_MAXIMO_SNAPSHOTS) -> pd.DataFrame:
+    """
+    Igual que calcular_plusvalias_fifo, pero guarda el estado de las carteras al cierre de cada año
+    fiscal y reanuda desde el último snapshot válido, recalculando solo los años posteriores.
+    Los precios forman parte de la huella de cada año: al cambiarlos se recalcula. Los snapshots
+    usados hace más tiempo se borran cuando el directorio pasa de `tamaño_maximo` bytes.
+    """
+    cols = _columnas_trades(df, precios)
+    tramos = snapshots.tramos_por_año(cols["fecha"])
+    huellas = snapshots.huellas_por_año(cols, tramos)
+
+    # Último año con snapshot válido (todos los anteriores también deben tenerlo)
+    reanudar = 0
+    while reanudar < len(tramos) and snapshots.existe_snapshot(directorio, tramos[reanudar][0], huellas[reanudar]):
+        reanudar += 1
+
+    wallets = defaultdict(ColaLotes)
+    partes = []
+    for k in range(reanudar):
+        guardado = snapshots.cargar_snapshot(directorio, tramos[k][0], huellas[k])
+        if guardado is None:
+            reanudar = k
+            break
+        partes.append(guardado)
+    if partes:
+        wallets.update({activo: ColaLotes.desde_estado(estado) for activo, estado in partes[-1]["wallets"].items()})
+
+    resultados = {columna: [] for columna in COLUMNAS_RESULTADO}
+    for parte in partes[:reanudar]:
+        for columna in COLUMNAS_RESULTADO:
+            resultados[columna].extend(parte["resultados"][columna])
+
+    # Reproducir solo los años sin snapshot
+    for (año, inicio, fin), huella in zip(tramos[reanudar:], huellas[reanudar:]):
+        resultados_año = {columna: [] for columna in COLUMNAS_RESULTADO}
+        _procesar_trades(cols, inicio, fin, [wallets], [resultados_año])
+        snapshots.guardar_snapshot(directorio, año, huella, wallets, resultados_año)
+        for columna in COLUMNAS_RESULTADO:
+            resultados[columna].extend(resultados_año[columna])
+    if reanudar < len(tramos):
+        snapshots.limpiar_snapshots(directorio, tamaño_maximo)
+
+    return pd.DataFrame(resultados, columns=COLUMNAS_RESULTADO)
+
+COLUMNAS_SUMA_CUBO = ["Cantidad vendida", "Ingreso EUR", "Coste EUR (FIFO)", "Ganancia/pérdida EUR", "Comisión"]
+
+@medir_etapa("cubo de agregados")
+def construir_cubo(resultados: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega las ventas por Cripto × Fecha (día) × Signo de la ganancia (1, 0, -1), con número de
+    operaciones, extremos y ganancia acumulada por cripto. Los resúmenes y gráficos se calculan
+    sobre este cubo, mucho más pequeño que la tabla de operaciones.
+    """
+    ganancia = resultados["Ganancia/pérdida EUR"].to_numpy(dtype=np.float64)
+    claves = {
+        "Cripto": resultados["Cripto"].to_numpy(),
+        "Fecha": pd.to_datetime(resultados["Fecha"]).dt.normalize().to_numpy(),
+        "Signo": np.where(ganancia > 0, 1, np.where(ganancia < 0, -1, 0)).astype(np.int8),
+    }
+    datos = resultados[COLUMNAS_SUMA_CUBO].assign(**claves)
+
+    cubo = datos.groupby(["Cripto", "Fecha", "Signo"], sort=True).agg(
+        **{columna: (columna, "sum") for columna in COLUMNAS_SUMA_CUBO},
+        **{
+            "Operaciones": ("Ganancia/pérdida EUR", "size"),
+            "Máxima ganancia": ("Ganancia/pérdida EUR", "max"),
+            "Mínima ganancia": ("Ganancia/pérdida EUR", "min"),
+        }
+    )
+    cubo["Ganancia acumulada"] = cubo.groupby(level="Cripto")["Ganancia/pérdida EUR"].cumsum()
+    return cubo
+
+def filtrar_cubo(cubo: pd.DataFrame, criptos=None, desde=None, hasta=None) -> pd.DataFrame:
+    """
+    Corte del cubo por criptos y rango de fechas (ambos extremos incluidos).
+    """
+    if cubo.empty:
+        return cubo
+    fechas = slice(pd.Timestamp(desde) if desde is not None else None,
+                   pd.Timestamp(hasta) if hasta is not None else None)
+    if criptos is None:
+        criptos = slice(None)
+    else:
+        criptos = [c for c in criptos if c in cubo.index.levels[0]]
+        if not criptos:
+            return cubo.iloc[:0]
+    return cubo.loc[pd.IndexSlice[criptos, fechas, :], :]
+
+def resumen_por_cripto(cubo: pd.DataFrame) -> pd.DataFrame:
+    """
+    Totales por cripto a partir del cubo, con el reparto de ganancias y pérdidas.
+    """
+    totales = cubo.groupby(level="Cripto")[COLUMNAS_SUMA_CUBO + ["Operaciones"]].sum()
+    por_signo = cubo.groupby(level=["Cripto", "Signo"])[["Ganancia/pérdida EUR", "Operaciones"]].sum().unstack("Signo")
+
+    def columna(nombre, signo):
+        if (nombre, signo) in por_signo.columns:
+            return por_signo[(nombre, signo)].reindex(totales.index).fillna(0)
+        return pd.Series(0.0, index=totales.index)
+
+    totales["Ganancias EUR"] = columna("Ganancia/pérdida EUR", 1)
+    totales["Pérdidas EUR"] = columna("Ganancia/pérdida EUR", -1)
+    totales["Operaciones positivas"] = columna("Operaciones", 1).astype(int)
+    totales["Operaciones negativas"] = columna("Operaciones", -1).astype(int)
+    totales["Porcentaje Ganancias"] = totales["Ganancias EUR"] / totales["Ganancias EUR"].sum() * 100
+    totales["Porcentaje Pérdidas"] = totales["Pérdidas EUR"].abs() / totales["Pérdidas EUR"].abs().sum() * 100
+    return totales.reset_index()
 
+# Granularidades para agregar la serie de ganancias cuando hay demasiados puntos que dibujar
+PERIODOS_AGREGACION = [("D", "día"), ("W", "semana"), ("MS", "mes"), ("QS", "trimestre")]
 
+def ganancias_por_periodo(cubo: pd.DataFrame, criptos=None, desde=None, hasta=None,
+                          max_puntos: int = 1500) -> tuple[pd.DataFrame, str]:
+    """
+    Ganancia y número de operaciones por Cripto × periodo a partir del cubo, con la granularidad
+    más fina (día, semana, mes, trimestre) que no supere `max_puntos`. Devuelve (serie, periodo).
+    """
+    corte = filtrar_cubo(cubo, criptos, desde, hasta)
+    columnas = ["Ganancia/pérdida EUR", "Operaciones"]
+    diario = corte.groupby(level=["Cripto", "Fecha"], observed=True)[columnas].sum().reset_index()
+    for frecuencia, periodo in PERIODOS_AGREGACION:
+        if frecuencia == "D":
+            serie = diario
+        else:
+            serie = diario.groupby(["Cripto", pd.Grouper(key="Fecha", freq=frecuencia)], observed=True)[columnas].sum().reset_index()
+        if len(serie) <= max_puntos:
+            break
+    return serie, periodo
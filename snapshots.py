@@ -0,0 +1,88 @@
+# snapshots.py
+
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from data_loader import limpiar_por_uso
+
+DIRECTORIO_SNAPSHOTS = os.path.join("data", "snapshots")
+TAMAÑO_MAXIMO_SNAPSHOTS = 256 * 1024 * 1024  # bytes
+
+# Cambiar al modificar la lógica del motor FIFO para invalidar los snapshots existentes
+VERSION_MOTOR = "4"
+
+def tramos_por_año(fechas: np.ndarray) -> list[tuple[int, int, int]]:
+    """
+    Divide un array de fechas ordenado en tramos (año, inicio, fin).
+    """
+    if len(fechas) == 0:
+        return []
+    años = pd.DatetimeIndex(pd.to_datetime(fechas)).year.to_numpy()
+    cortes = np.flatnonzero(np.diff(años)) + 1
+    inicios = np.concatenate(([0], cortes))
+    fines = np.concatenate((cortes, [len(años)]))
+    return [(int(años[i]), int(i), int(f)) for i, f in zip(inicios, fines)]
+
+def huellas_por_año(cols: dict, tramos: list[tuple[int, int, int]]) -> list[str]:
+    """
+    Huella encadenada de cada año: depende del contenido de ese año y de todos los anteriores,
+    así que cualquier cambio en una fila antigua invalida los snapshots posteriores.
+    """
+    huellas = []
+    previa = VERSION_MOTOR.encode()
+    for _, inicio, fin in tramos:
+        tramo = pd.DataFrame({nombre: valores[inicio:fin] for nombre, valores in cols.items()})
+        h = hashlib.sha1(previa)
+        h.update(pd.util.hash_pandas_object(tramo, index=False).to_numpy().tobytes())
+        previa = h.hexdigest().encode()
+        huellas.append(h.hexdigest())
+    return huellas
+
+def _ruta(directorio: str, año: int, huella: str) -> str:
+    return os.path.join(directorio, f"{año}-{huella}.pkl")
+
+def existe_snapshot(directorio: str, año: int, huella: str) -> bool:
+    return os.path.exists(_ruta(directorio, año, huella))
+
+def guardar_snapshot(directorio: str, año: int, huella: str, wallets: dict, resultados_año: dict):
+    """
+    Guarda los lotes abiertos al cierre del año y las ventas realizadas durante ese año.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    contenido = {
+        "wallets": {activo: cola.estado() for activo, cola in wallets.items() if len(cola)},
+        "resultados": resultados_año,
+    }
+    # Dos trabajos con los mismos años anteriores pueden guardar el mismo snapshot a la vez: cada
+    # uno escribe su propio temporal y, si algo falla, se sigue sin snapshot
+    ruta = _ruta(directorio, año, huella)
+    temporal = None
+    try:
+        descriptor, temporal = tempfile.mkstemp(prefix=os.path.basename(ruta) + ".", suffix=".tmp", dir=directorio)
+        with os.fdopen(descriptor, "wb") as f:
+            pickle.dump(contenido, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+    except Exception:
+        if temporal and os.path.exists(temporal):
+            os.remove(temporal)
+
+def cargar_snapshot(directorio: str, año: int, huella: str) -> dict | None:
+    ruta = _ruta(directorio, año, huella)
+    try:
+        with open(ruta, "rb") as f:
+            contenido = pickle.load(f)
+        os.utime(ruta)  # Marca de uso reciente para la política LRU
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return contenido
+
+def limpiar_snapshots(directorio: str = DIRECTORIO_SNAPSHOTS, tamaño_maximo: int = TAMAÑO_MAXIMO_SNAPSHOTS):
+    """
+    Elimina los snapshots usados hace más tiempo hasta que ocupen como mucho `tamaño_maximo` bytes.
+    Con el mismo uso se borran antes los años posteriores: un snapshot solo sirve si están todos
+    los de los años anteriores.
+    """
+    limpiar_por_uso(directorio, tamaño_maximo, ".pkl", desempate=lambda nombre: -int(nombre.split("-", 1)[0]))
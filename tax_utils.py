@@ -1,58 +1,179 @@
 # tax_utils.py
 import pandas as pd
+import numpy as np
+from functools import lru_cache
+from instrumentacion import medir_etapa
+from almacen import AlmacenTransacciones
+
+# Tipos de transacción que se incluyen en la declaración del IRPF
+TIPOS_SUJETOS_IRPF = ["Trade"]
 
 def es_transaccion_sujeta_a_irpf(row):
     """
     Determina si la transacción debería ser incluida en la declaración de la renta.
     """
-    if row["Transaction Type"] == "Trade":
+    if row["Transaction Type"] in TIPOS_SUJETOS_IRPF:
         return "Yes"
     return "No"  # Deposits, Withdrawals y Internal Transfers no generan IRPF
 
+@medir_etapa("resumen_fiscal")
 def resumen_fiscal(df):
     """
     Muestra un resumen de qué transacciones están sujetas a IRPF.
     """
-    df["Sujeta a IRPF"] = df.apply(es_transaccion_sujeta_a_irpf, axis=1)
+    sujeta = df["Transaction Type"].isin(TIPOS_SUJETOS_IRPF).to_numpy()
+    df["Sujeta a IRPF"] = pd.Categorical(np.where(sujeta, "Yes", "No"), categories=["No", "Yes"])
     return df
 
- # Calcular impuestos según los tramos
-def calcular_impuestos(ganancia):
-    if ganancia <= 6000:
-        return ganancia * 0.19
-    elif ganancia <= 50000:
-        return 6000 * 0.19 + (ganancia - 6000) * 0.21
-    elif ganancia <= 200000:
-        return 6000 * 0.19 + (50000 - 6000) * 0.21 + (ganancia - 50000) * 0.23
-    else:
-        return 6000 * 0.19 + (50000 - 6000) * 0.21 + (200000 - 50000) * 0.23 + (ganancia - 200000) * 0.27
-    
-def filtrar_plusvalias_sobre_retiradas(transacciones_df: pd.DataFrame, plusvalias_df: pd.DataFrame) -> (pd.DataFrame, int, float):
+# Tramos de la base del ahorro: (base desde la que se aplica, tipo). El último tramo no tiene límite.
+TRAMOS_POR_DEFECTO = ((0, 0.19), (6000, 0.21), (50000, 0.23), (200000, 0.27))
+
+# Tabla vigente a partir de cada año (se aplica la del último año <= año fiscal; los años anteriores
+# al primero usan la tabla más antigua)
+TRAMOS_POR_AÑO = {
+    2015: ((0, 0.195), (6000, 0.215), (50000, 0.235)),
+    2016: ((0, 0.19), (6000, 0.21), (50000, 0.23)),
+    2021: ((0, 0.19), (6000, 0.21), (50000, 0.23), (200000, 0.26)),
+    2023: ((0, 0.19), (6000, 0.21), (50000, 0.23), (200000, 0.27), (300000, 0.28)),
+    2025: ((0, 0.19), (6000, 0.21), (50000, 0.23), (200000, 0.27), (300000, 0.30)),
+}
+
+def tramos_del_año(año: int | None) -> tuple:
+    if año is None:
+        return TRAMOS_POR_DEFECTO
+    vigentes = [inicio for inicio in TRAMOS_POR_AÑO if inicio <= año]
+    return TRAMOS_POR_AÑO[max(vigentes) if vigentes else min(TRAMOS_POR_AÑO)]
+
+@lru_cache(maxsize=None)
+def _bases_y_cuotas(tramos: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Filtra las plusvalías relacionadas con retiradas y calcula el total de retiradas y la cantidad retirada.
+    Base inicial, tipo y cuota acumulada al empezar cada tramo.
+    """
+    bases = np.array([base for base, _ in tramos], dtype=float)
+    tipos = np.array([tipo for _, tipo in tramos], dtype=float)
+    cuotas = np.zeros(len(tramos))
+    for i in range(1, len(tramos)):
+        cuotas[i] = cuotas[i - 1] + (bases[i] - bases[i - 1]) * tipos[i - 1]
+    return bases, tipos, cuotas
+
+def calcular_impuestos_vectorizado(ganancias, año=None, tramos: tuple | None = None) -> np.ndarray:
+    """
+    Cuota de un array de ganancias: el tramo de cada una se busca con searchsorted y se suma la
+    cuota acumulada de los tramos anteriores. `año` puede ser un año, None (tabla por defecto) o un
+    array con el año de cada ganancia; `tramos` fuerza una tabla concreta.
     """
-    # Asegurar que las fechas estén en formato datetime
-    transacciones_df["Date"] = pd.to_datetime(transacciones_df["Date"])
-    plusvalias_df["Fecha"] = pd.to_datetime(plusvalias_df["Fecha"])
+    ganancias = np.asarray(ganancias, dtype=float)
+    if tramos is None and año is not None and np.ndim(año) > 0:
+        años = np.broadcast_to(np.asarray(año), ganancias.shape)
+        cuotas = np.empty(ganancias.shape)
+        for valor in np.unique(años):
+            mascara = años == valor
+            cuotas[mascara] = calcular_impuestos_vectorizado(ganancias[mascara], int(valor))
+        return cuotas
+
+    bases, tipos, cuotas = _bases_y_cuotas(tramos or tramos_del_año(año))
+    # Las ganancias negativas quedan en el primer tramo, como en el cálculo por tramos original
+    tramo = np.maximum(np.searchsorted(bases, ganancias, side="left") - 1, 0)
+    return cuotas[tramo] + (ganancias - bases[tramo]) * tipos[tramo]
 
-    # Filtrar transacciones que son retiradas de EUR (Non-taxable + Outgoing EUR)
-    retiradas = transacciones_df[
-        (transacciones_df["Transaction Type"] == "Non-taxable") &
-        (transacciones_df["Outgoing Asset"] == "EUR")
-    ].copy()
+# Calcular impuestos según los tramos
+def calcular_impuestos(ganancia, año: int | None = None):
+    return float(calcular_impuestos_vectorizado(ganancia, año))
 
-    if retiradas.empty:
-        return pd.DataFrame(columns=plusvalias_df.columns), 0, 0.0  # No hay retiradas
+@medir_etapa("filtro de retiradas")
+def filtrar_plusvalias_sobre_retiradas(transacciones: pd.DataFrame | AlmacenTransacciones,
+                                       plusvalias: pd.DataFrame | AlmacenTransacciones) -> (pd.DataFrame, int, float):
+    """
+    Filtra las plusvalías relacionadas con retiradas y calcula el total de retiradas y la cantidad retirada.
+    Acepta DataFrames o almacenes ya indexados (las plusvalías, por la columna "Fecha").
+    """
+    if not isinstance(transacciones, AlmacenTransacciones):
+        transacciones = AlmacenTransacciones(transacciones)
+    if not isinstance(plusvalias, AlmacenTransacciones):
+        plusvalias = AlmacenTransacciones(plusvalias, "Fecha", claves=())
+
+    # Retiradas de EUR (Non-taxable + Outgoing EUR), directamente desde el índice por tipo y activo
+    posiciones = transacciones.posiciones(("Non-taxable", "EUR"))
+    if not len(posiciones):
+        return pd.DataFrame(columns=plusvalias.df.columns), 0, 0.0  # No hay retiradas
 
     # Calcular el total de retiradas y la cantidad retirada
-    total_retiradas = len(retiradas)
-    cantidad_total_retiradas = retiradas["Outgoing Amount"].sum()
+    total_retiradas = len(posiciones)
+    cantidad_total_retiradas = transacciones.df["Outgoing Amount"].iloc[posiciones].sum()
 
-    # Tomamos la fecha máxima de retirada como tope para las ventas
-    fecha_limite = retiradas["Date"].max()
+    # Las posiciones van ordenadas por fecha: la última es la fecha máxima de retirada, tope para las ventas
+    fecha_limite = transacciones.fechas[posiciones[-1]]
 
-    # Filtrar plusvalías (ventas de cripto por EUR) que ocurrieron hasta esa fecha
-    plusvalias_filtradas = plusvalias_df[plusvalias_df["Fecha"] <= fecha_limite].copy()
+    # Plusvalías (ventas de cripto por EUR) que ocurrieron hasta esa fecha
+    plusvalias_filtradas = plusvalias.rango(hasta=fecha_limite)
 
     return plusvalias_filtradas, total_retiradas, cantidad_total_retiradas
 
+COLUMNAS_INFORME_PLURIANUAL = [
+    "Año fiscal", "Operaciones", "Ganancia/pérdida EUR", "Comisiones EUR", "Número de retiradas",
+    "Cantidad retirada EUR", "Ganancia neta a declarar EUR", "Impuestos a pagar EUR",
+]
+
+@medir_etapa("informe plurianual")
+def informe_plurianual(transacciones: pd.DataFrame | AlmacenTransacciones,
+                       plusvalias: pd.DataFrame | AlmacenTransacciones, años: list[int] | None = None) -> pd.DataFrame:
+    """
+    Declaración de todos los años a partir de una única pasada FIFO sobre todo el historial (los
+    lotes abiertos pasan de un año al siguiente). Operaciones, ganancia, comisiones y retiradas son
+    las del propio año. La ganancia neta de cada año son las ventas hasta su última retirada que no
+    quedaron cubiertas por la última retirada de un año anterior: cada venta se declara una sola vez
+    y un año sin retiradas no declara nada. Los impuestos usan la tabla de tramos de cada año.
+    """
+    if not isinstance(transacciones, AlmacenTransacciones):
+        transacciones = AlmacenTransacciones(transacciones)
+    if not isinstance(plusvalias, AlmacenTransacciones):
+        plusvalias = AlmacenTransacciones(plusvalias, "Fecha", claves=())
+    if años is None:
+        if not len(transacciones):
+            return pd.DataFrame(columns=COLUMNAS_INFORME_PLURIANUAL)
+        años = range(pd.Timestamp(transacciones.fechas[0]).year, pd.Timestamp(transacciones.fechas[-1]).year + 1)
+
+    # Fechas e importes de todas las retiradas, ordenados: cada año es un corte por búsqueda binaria
+    posiciones_retiradas = transacciones.posiciones(("Non-taxable", "EUR"))
+    fechas_retiradas = transacciones.fechas[posiciones_retiradas]
+    importes_retiradas = transacciones.df["Outgoing Amount"].to_numpy(dtype=float)[posiciones_retiradas]
+
+    def ganancia_hasta_retirada(k: int) -> float:
+        # Ganancia de las ventas hasta la k-ésima retirada (incluida); 0 si k == 0
+        if k == 0:
+            return 0.0
+        return float(plusvalias.rango(hasta=fechas_retiradas[k - 1])["Ganancia/pérdida EUR"].sum())
+
+    filas = []
+    for año in años:
+        inicio, fin = pd.Timestamp(año, 1, 1), pd.Timestamp(año, 12, 31, 23, 59, 59)
+        operaciones = plusvalias.rango(inicio, fin)
+        desde = np.searchsorted(fechas_retiradas, inicio.to_datetime64(), side="left")
+        hasta = np.searchsorted(fechas_retiradas, fin.to_datetime64(), side="right")
+
+        ganancia_neta = 0.0
+        if hasta > desde:
+            # Ventas hasta la última retirada del año menos las ya declaradas en años anteriores
+            ganancia_neta = ganancia_hasta_retirada(hasta) - ganancia_hasta_retirada(desde)
+        filas.append({
+            "Año fiscal": año,
+            "Operaciones": len(operaciones),
+            "Ganancia/pérdida EUR": float(operaciones["Ganancia/pérdida EUR"].sum()),
+            "Comisiones EUR": float(operaciones["Comisión"].sum()),
+            "Número de retiradas": int(hasta - desde),
+            "Cantidad retirada EUR": float(importes_retiradas[desde:hasta].sum()),
+            "Ganancia neta a declarar EUR": ganancia_neta,
+        })
+    informe = pd.DataFrame(filas, columns=COLUMNAS_INFORME_PLURIANUAL)
+    informe["Impuestos a pagar EUR"] = calcular_impuestos_vectorizado(
+        informe["Ganancia neta a declarar EUR"].to_numpy(), informe["Año fiscal"].to_numpy()
+    )
+    return informe
+
+def declaracion_del_año(transacciones: pd.DataFrame | AlmacenTransacciones,
+                        plusvalias: pd.DataFrame | AlmacenTransacciones, año: int) -> dict:
+    """
+    Fila de informe_plurianual para un solo año: la app, el pipeline y el lote declaran con la
+    misma regla (cada venta una sola vez) que el informe de todos los años.
+    """
+    return informe_plurianual(transacciones, plusvalias, [año]).iloc[0].to_dict()
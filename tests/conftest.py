@@ -0,0 +1,17 @@
+import os
+import sys
+import pandas as pd
+
+# Los módulos de la app están en la raíz del repositorio, sin paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COLUMNAS_TRANSACCIONES = ["Date", "Transaction Type", "Outgoing Asset", "Outgoing Amount",
+                          "Incoming Asset", "Incoming Amount", "Fee Amount (optional)"]
+
+def transacciones_de(filas) -> pd.DataFrame:
+    """
+    Transacciones mínimas a partir de tuplas con las columnas de COLUMNAS_TRANSACCIONES.
+    """
+    df = pd.DataFrame(filas, columns=COLUMNAS_TRANSACCIONES)
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
@@ -0,0 +1,63 @@
+import os
+import threading
+
+import data_loader
+from data_loader import limpiar_cache
+
+def _crear_entradas(directorio, n, tamaño=100):
+    for i in range(n):
+        ruta = os.path.join(directorio, f"csv-{i}.parquet")
+        with open(ruta, "wb") as f:
+            f.write(b"x" * tamaño)
+        os.utime(ruta, (i, i))
+
+def test_limpiar_cache_borra_las_menos_usadas(tmp_path):
+    _crear_entradas(tmp_path, 5)
+    limpiar_cache(str(tmp_path), tamaño_maximo=250)
+    assert sorted(os.listdir(tmp_path)) == ["csv-3.parquet", "csv-4.parquet"]
+
+def test_limpiar_cache_salta_entradas_borradas_por_otro(tmp_path, monkeypatch):
+    # Entre listdir y stat/remove otro hilo ya ha borrado una entrada
+    _crear_entradas(tmp_path, 3)
+    listdir = os.listdir
+    monkeypatch.setattr(data_loader.os, "listdir", lambda d: listdir(d) + ["csv-borrada.parquet"])
+    limpiar_cache(str(tmp_path), tamaño_maximo=0)
+    assert listdir(tmp_path) == []
+
+def test_limpiar_cache_concurrente(tmp_path):
+    _crear_entradas(tmp_path, 200, tamaño=10)
+    errores = []
+
+    def limpiar():
+        try:
+            limpiar_cache(str(tmp_path), tamaño_maximo=0)
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=limpiar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert errores == [] and os.listdir(tmp_path) == []
+
+def test_limpiar_cache_sin_directorio(tmp_path):
+    limpiar_cache(str(tmp_path / "no-existe"))
+
+def test_la_cache_de_subidas_depende_de_las_reglas(tmp_path, monkeypatch):
+    from generador_sintetico import generar_ledger, escribir_csvs
+    from trabajos import clave_trabajo
+    ruta, = escribir_csvs(generar_ledger(200, activos=3, semilla=3), str(tmp_path / "csv"))
+    with open(ruta, "rb") as f:
+        contenidos = [f.read()]
+    directorio = str(tmp_path / "cache")
+    antes = data_loader.load_cached_uploads(contenidos, directorio)
+    clave_antes = clave_trabajo(["x"])
+    assert "Trade" in set(antes["Transaction Type"])
+
+    monkeypatch.setattr(data_loader, "REGLAS_CLASIFICACION", list(data_loader.REGLAS_CLASIFICACION))
+    data_loader.registrar_regla("trade", "Compraventa", posicion=0)
+    despues = data_loader.load_cached_uploads(contenidos, directorio)
+    assert "Trade" not in set(despues["Transaction Type"])
+    assert (despues["Transaction Type"] == "Compraventa").sum() == (antes["Transaction Type"] == "Trade").sum()
+    assert clave_trabajo(["x"]) != clave_antes
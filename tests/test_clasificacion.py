@@ -0,0 +1,41 @@
+# Paridad de clasificar_transacciones (vectorizada) con classify_transaction (fila a fila)
+import numpy as np
+import pandas as pd
+import pytest
+from data_loader import classify_transaction, clasificar_transacciones, TIPO_POR_DEFECTO
+
+CASOS = [
+    ("Trade", "Trade"),
+    ("TRADE", "Trade"),
+    ("trade ", "Trade"),
+    ("Deposit", "Deposit"),
+    ("Withdrawal", "Withdrawal"),
+    ("Staking", "Staking"),
+    ("Auto Balance", "Internal Transfer"),
+    ("Non-Taxable", "Non-taxable"),
+    # Varios patrones a la vez: gana la primera regla
+    ("deposit trade", "Trade"),
+    ("staking withdrawal", "Withdrawal"),
+    ("non-taxable deposit", "Deposit"),
+    ("auto balance staking", "Staking"),
+    # Sin coincidencias
+    ("Transfer", TIPO_POR_DEFECTO),
+    ("", TIPO_POR_DEFECTO),
+    ("trad e", TIPO_POR_DEFECTO),
+]
+
+@pytest.mark.parametrize("label, tipo", CASOS)
+def test_classify_transaction(label, tipo):
+    assert classify_transaction({"Label": label}) == tipo
+
+def test_vectorizada_igual_que_fila_a_fila():
+    labels = pd.Series([label for label, _ in CASOS] * 3, index=np.arange(len(CASOS) * 3) * 2)
+    tipos = clasificar_transacciones(labels)
+    esperado = [classify_transaction({"Label": label}) for label in labels]
+    assert tipos.astype(str).tolist() == esperado
+    assert tipos.index.equals(labels.index)
+
+def test_label_vacio_es_tipo_por_defecto():
+    tipos = clasificar_transacciones(pd.Series(["Trade", np.nan, None, "Deposit"]))
+    assert tipos.astype(str).tolist() == ["Trade", TIPO_POR_DEFECTO, TIPO_POR_DEFECTO, "Deposit"]
+    assert len(clasificar_transacciones(pd.Series([], dtype=object))) == 0
@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+from tax_utils import informe_plurianual
+
+def _datos():
+    transacciones = pd.DataFrame({
+        "Date": pd.to_datetime(["2022-03-01", "2022-06-01", "2023-05-01", "2024-02-01", "2024-09-01"]),
+        "Transaction Type": ["Trade", "Non-taxable", "Trade", "Trade", "Non-taxable"],
+        "Outgoing Asset": ["BTC", "EUR", "BTC", "BTC", "EUR"],
+        "Outgoing Amount": [1.0, 500.0, 1.0, 1.0, 300.0],
+    })
+    plusvalias = pd.DataFrame({
+        "Fecha": pd.to_datetime(["2022-03-01", "2023-05-01", "2024-02-01", "2024-10-01"]),
+        "Ganancia/pérdida EUR": [100.0, 40.0, 10.0, 7.0],
+        "Comisión": [0.0, 0.0, 0.0, 0.0],
+    })
+    return transacciones, plusvalias
+
+def test_cada_venta_se_declara_una_vez():
+    informe = informe_plurianual(*_datos()).set_index("Año fiscal")
+    # 2023 no tiene retiradas: no vuelve a declarar lo de 2022 ni nada propio
+    assert informe["Ganancia neta a declarar EUR"].to_dict() == {2022: 100.0, 2023: 0.0, 2024: 50.0}
+    assert informe.loc[2023, "Impuestos a pagar EUR"] == 0.0
+    # La venta posterior a la última retirada aún no se declara
+    assert informe["Ganancia neta a declarar EUR"].sum() == pytest.approx(150.0)
+
+def test_subconjunto_de_años_descuenta_lo_declarado_antes():
+    informe = informe_plurianual(*_datos(), años=[2024])
+    assert informe["Ganancia neta a declarar EUR"].tolist() == [50.0]
+
+def test_pipeline_de_un_año_coincide_con_el_informe(tmp_path):
+    from generador_sintetico import generar_ledger, escribir_csvs
+    from pipeline import ejecutar_pipeline, ejecutar_informe_plurianual
+    rutas = escribir_csvs(generar_ledger(3000, activos=6, semilla=5), str(tmp_path), 2)
+    informe = ejecutar_informe_plurianual(rutas)[0]["informe"].set_index("Año fiscal")
+    assert informe["Ganancia neta a declarar EUR"].abs().sum() > 0
+    for año, fila in informe.iterrows():
+        resumen = ejecutar_pipeline(rutas, año)[0]["resumen"]
+        assert resumen["Ganancia neta a declarar EUR"] == pytest.approx(fila["Ganancia neta a declarar EUR"])
+        assert resumen["Impuestos a pagar EUR"] == pytest.approx(fila["Impuestos a pagar EUR"])
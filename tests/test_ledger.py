@@ -0,0 +1,59 @@
+# Ledger: altas solo de Trx. ID nuevos, filas sin ID como un único ID y compactación
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import ledger as modulo_ledger
+from data_loader import load_bitpanda_csv, combinar_transacciones
+from generador_sintetico import generar_ledger, escribir_csvs
+from ledger import Ledger
+
+def _ordenar(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_values(["Date (UTC)", "Trx. ID (optional)"], kind="stable", na_position="first")
+    return df.where(df.notna(), np.nan).reset_index(drop=True)
+
+@pytest.fixture
+def exportaciones(tmp_path):
+    df = generar_ledger(400, activos=4, tasa_duplicados=0.1, semilla=9)
+    sin_id = df.iloc[[5, 50]].copy()
+    sin_id["Trx. ID (optional)"] = np.nan
+    df = pd.concat([df, sin_id], ignore_index=True)
+    # Dos exportaciones que se solapan, como al volver a descargar un periodo ya subido
+    primera = escribir_csvs(df.iloc[:300], str(tmp_path / "a"))[0]
+    segunda = escribir_csvs(df.iloc[200:], str(tmp_path / "b"))[0]
+    return load_bitpanda_csv(primera), load_bitpanda_csv(segunda)
+
+def test_ida_y_vuelta_igual_que_combinar(tmp_path, exportaciones):
+    primera, segunda = exportaciones
+    historial = Ledger(str(tmp_path / "ledger"))
+    assert not os.path.exists(historial.directorio)
+
+    añadidas = historial.añadir(primera)
+    assert añadidas == len(combinar_transacciones([primera]))
+    añadidas += historial.añadir(segunda)
+    assert historial.añadir(segunda) == 0  # volver a subir lo mismo no añade nada
+
+    esperado = combinar_transacciones([primera, segunda])
+    assert añadidas == len(historial) == len(esperado)
+    assert esperado["Trx. ID (optional)"].isna().sum() == 1  # las filas sin ID cuentan como una
+    pd.testing.assert_frame_equal(_ordenar(historial.to_pandas()), _ordenar(esperado), check_dtype=False)
+
+    huella = historial.huella()
+    historial.compactar()
+    assert historial._segmentos() == [] and historial.huella() != huella
+    pd.testing.assert_frame_equal(_ordenar(historial.to_pandas()), _ordenar(esperado), check_dtype=False)
+    assert historial.to_pandas()["Date (UTC)"].is_monotonic_increasing
+
+    # Tras compactar se siguen reconociendo los ID ya guardados
+    assert Ledger(historial.directorio).añadir(primera) == 0
+
+def test_compacta_al_superar_los_segmentos(tmp_path, exportaciones, monkeypatch):
+    monkeypatch.setattr(modulo_ledger, "MAX_SEGMENTOS", 2)
+    primera, segunda = exportaciones
+    historial = Ledger(str(tmp_path / "ledger"))
+    for parte in np.array_split(np.arange(len(primera)), 5):
+        historial.añadir(primera.iloc[parte])
+    assert len(historial._segmentos()) <= 2
+    historial.añadir(segunda)
+    esperado = combinar_transacciones([primera, segunda])
+    pd.testing.assert_frame_equal(_ordenar(historial.to_pandas()), _ordenar(esperado), check_dtype=False)
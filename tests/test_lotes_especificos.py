@@ -0,0 +1,48 @@
+# Identificación específica de lotes y columnas de la comparación de métodos
+import pandas as pd
+import pytest
+from conftest import transacciones_de
+from lots import LotesEspecificos
+from processor import (calcular_plusvalias, calcular_plusvalias_metodos, calcular_plusvalias_fifo, comparar_metodos,
+                       COLUMNAS_METODOS, COLUMNAS_RESULTADO)
+
+COMPRAS_Y_VENTAS = [
+    ("2024-01-01", "Trade", "EUR", 100.0, "BTC", 1.0, 0.0),
+    ("2024-02-01", "Trade", "EUR", 300.0, "BTC", 1.0, 0.0),
+    ("2024-03-01", "Trade", "EUR", 200.0, "BTC", 1.0, 0.0),
+    ("2024-04-01", "Trade", "BTC", 1.5, "EUR", 600.0, 0.0),
+    ("2024-05-01", "Trade", "BTC", 1.0, "EUR", 400.0, 0.0),
+]
+
+def test_consume_los_lotes_indicados_y_despues_fifo():
+    lotes = LotesEspecificos()
+    for dia, precio in ((1, 100.0), (2, 300.0), (3, 200.0)):
+        lotes.agregar(1.0, precio, pd.Timestamp(2024, 1, dia))
+    assert lotes.consumir(1.5, [pd.Timestamp(2024, 1, 3)]) == (1.5, 250.0)
+    assert lotes.estado()["cantidad"].tolist() == [0.5, 1.0]
+    assert lotes.consumir(2.0) == (1.5, 350.0)
+    assert len(lotes) == 0
+
+def test_sin_seleccion_es_fifo():
+    df = transacciones_de(COMPRAS_Y_VENTAS)
+    pd.testing.assert_frame_equal(calcular_plusvalias(df, "Lotes específicos"), calcular_plusvalias(df, "FIFO"))
+
+def test_seleccion_por_fecha_de_adquisicion():
+    df = transacciones_de(COMPRAS_Y_VENTAS)
+    seleccion = {("BTC", "2024-04-01"): ["2024-02-01", "2024-03-01"]}
+    resultado = calcular_plusvalias_metodos(df, ("FIFO", "Lotes específicos"), seleccion_lotes=seleccion)
+    assert resultado["FIFO"]["Coste EUR"].tolist() == pytest.approx([250.0, 250.0])
+    # La primera venta toma el lote de febrero y medio de marzo; la segunda sigue en FIFO (enero)
+    assert resultado["Lotes específicos"]["Coste EUR"].tolist() == pytest.approx([400.0, 100.0])
+
+def test_comparacion_con_columnas_neutras():
+    df = transacciones_de(COMPRAS_Y_VENTAS)
+    comparacion = comparar_metodos(df)
+    assert "Lotes específicos" not in comparacion["Método"].tolist()
+    assert list(comparacion.columns) == ["Método", "Operaciones", "Ingreso EUR", "Coste EUR", "Ganancia/pérdida EUR"]
+    con_seleccion = comparar_metodos(df, seleccion_lotes={("BTC", "2024-04-01"): ["2024-02-01"]})
+    assert "Lotes específicos" in con_seleccion["Método"].tolist()
+    for resultados in calcular_plusvalias_metodos(df, ("FIFO", "LIFO", "HIFO", "Coste medio")).values():
+        assert list(resultados.columns) == COLUMNAS_METODOS
+    # La salida de calcular_plusvalias_fifo conserva su columna de coste
+    assert list(calcular_plusvalias_fifo(df).columns) == COLUMNAS_RESULTADO
@@ -0,0 +1,86 @@
+# Paridad del motor FIFO con colas de lotes (ColaLotes) frente a la implementación original con iterrows
+from collections import defaultdict
+import pandas as pd
+import pytest
+from data_loader import load_multiple_csvs, preprocess_df
+from conftest import transacciones_de
+from generador_sintetico import generar_ledger, escribir_csvs
+from processor import calcular_plusvalias_fifo, COLUMNAS_RESULTADO, safe_float
+
+# Columnas de salida de la implementación original: no deben cambiar
+COLUMNAS_ORIGINALES = [
+    "Fecha", "Cripto", "Cantidad vendida", "Ingreso EUR", "Coste EUR (FIFO)", "Ganancia/pérdida EUR", "Comisión"
+]
+
+def fifo_referencia(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    calcular_plusvalias_fifo antes de las colas de lotes (listas con pop(0) e iterrows). Solo
+    cambia la ordenación, ahora estable como en el motor actual.
+    """
+    df_trades = df[df["Transaction Type"] == "Trade"].sort_values("Date", kind="stable")
+    wallets = defaultdict(list)
+    resultados = []
+
+    def consumir(activo, cantidad_a_vender):
+        cantidad_vendida = coste = 0.0
+        while cantidad_a_vender > 0 and wallets[activo]:
+            entrada = wallets[activo][0]
+            if entrada["cantidad"] <= cantidad_a_vender:
+                cantidad_vendida += entrada["cantidad"]
+                coste += entrada["cantidad"] * entrada["precio_unitario"]
+                cantidad_a_vender -= entrada["cantidad"]
+                wallets[activo].pop(0)
+            else:
+                cantidad_vendida += cantidad_a_vender
+                coste += cantidad_a_vender * entrada["precio_unitario"]
+                entrada["cantidad"] -= cantidad_a_vender
+                cantidad_a_vender = 0
+        return cantidad_vendida, coste
+
+    for _, row in df_trades.iterrows():
+        out_asset, in_asset = row["Outgoing Asset"], row["Incoming Asset"]
+        out_amt, in_amt = safe_float(row["Outgoing Amount"]), safe_float(row["Incoming Amount"])
+        fee = safe_float(row.get("Fee Amount (optional)", 0.0))
+        date = row["Date"]
+
+        if out_asset == "EUR" and pd.notna(in_asset):
+            wallets[in_asset].append({"cantidad": in_amt, "precio_unitario": out_amt / in_amt if in_amt else 0})
+        elif in_asset == "EUR" and pd.notna(out_asset):
+            cantidad_vendida, coste = consumir(out_asset, out_amt)
+            resultados.append([date, out_asset, cantidad_vendida, in_amt - fee, coste, in_amt - fee - coste, fee])
+        elif pd.notna(out_asset) and pd.notna(in_asset) and out_asset != "EUR" and in_asset != "EUR":
+            cantidad_vendida, coste = consumir(out_asset, out_amt)
+            wallets[in_asset].append({"cantidad": in_amt, "precio_unitario": coste / in_amt if in_amt else 0})
+            resultados.append([date, out_asset, cantidad_vendida, coste, coste, 0.0, fee])
+
+    return pd.DataFrame(resultados, columns=COLUMNAS_ORIGINALES)
+
+@pytest.mark.parametrize("compacto", [False, True])
+def test_paridad_ledger_sintetico(tmp_path, compacto):
+    rutas = escribir_csvs(generar_ledger(3000, activos=6, semilla=7), str(tmp_path), 2)
+    df = preprocess_df(load_multiple_csvs(rutas), compacto=compacto)
+    resultado = calcular_plusvalias_fifo(df)
+    assert len(resultado) > 0
+    pd.testing.assert_frame_equal(resultado, fifo_referencia(df), check_dtype=False)
+
+def test_paridad_permutas_y_cartera_vaciada():
+    df = transacciones_de([
+        ("2024-01-01", "Trade", "EUR", 100.0, "BTC", 2.0, 1.0),
+        ("2024-01-02", "Trade", "EUR", 90.0, "BTC", 1.0, 0.0),
+        ("2024-01-03", "Trade", "BTC", 2.5, "ETH", 10.0, 0.5),   # permuta que cruza dos lotes
+        ("2024-01-04", "Trade", "BTC", 0.5, "EUR", 60.0, 0.0),   # venta que vacía la cartera
+        ("2024-01-05", "Trade", "BTC", 1.0, "EUR", 80.0, 0.0),   # venta sin lotes
+        ("2024-01-06", "Trade", "ETH", 4.0, "EUR", 500.0, 2.0),
+        ("2024-01-06", "Deposit", None, 0.0, "EUR", 1000.0, 0.0),
+    ])
+    resultado = calcular_plusvalias_fifo(df)
+    pd.testing.assert_frame_equal(resultado, fifo_referencia(df), check_dtype=False)
+    assert resultado["Cantidad vendida"].tolist() == [2.5, 0.5, 0.0, 4.0]
+    assert resultado["Coste EUR (FIFO)"].tolist() == pytest.approx([145.0, 45.0, 0.0, 58.0])
+
+def test_resultado_vacio():
+    df = transacciones_de([("2024-01-01", "Deposit", None, 0.0, "EUR", 1000.0, 0.0)])
+    resultado = calcular_plusvalias_fifo(df)
+    assert resultado.empty
+    assert list(resultado.columns) == COLUMNAS_RESULTADO == COLUMNAS_ORIGINALES
+    pd.testing.assert_frame_equal(resultado, fifo_referencia(df), check_dtype=False, check_index_type=False)
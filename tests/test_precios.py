@@ -0,0 +1,70 @@
+# Valoración a precio de mercado: consultas al almacén de precios y su uso en el motor FIFO
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import transacciones_de
+from precios import AlmacenPrecios
+from processor import calcular_plusvalias_fifo
+
+def _almacen(filas, **kwargs):
+    return AlmacenPrecios(pd.DataFrame(filas, columns=["Activo", "Fecha", "Precio EUR"]), **kwargs)
+
+def test_valorar_eur_tolerancia_y_fechas_vacias():
+    almacen = _almacen([("C001", "2022-01-01", 10.0), ("C002", "2021-12-20", 20.0)])
+    precios = almacen.valorar(["C001", "C002", "EUR", "C001", "X"],
+                              ["2022-01-01", pd.NaT, "2022-01-01", "2022-01-09", "2022-01-01"])
+    # Sin fecha no hay precio (antes se tomaba el de otro activo) y más allá de 7 días tampoco
+    np.testing.assert_array_equal(precios, [10.0, np.nan, 1.0, np.nan, np.nan])
+    # La caché no cambia el resultado
+    np.testing.assert_array_equal(almacen.valorar(["C002", "C001"], [pd.NaT, "2022-01-03"]), [np.nan, 10.0])
+
+def test_permuta_a_precio_de_mercado():
+    df = transacciones_de([
+        ("2024-01-01", "Trade", "EUR", 100.0, "BTC", 1.0, 0.0),
+        ("2024-02-01", "Trade", "BTC", 1.0, "ETH", 10.0, 0.0),
+        ("2024-03-01", "Trade", "ETH", 10.0, "EUR", 200.0, 0.0),
+    ])
+    precios = _almacen([("BTC", "2024-02-01", 150.0)])
+    resultado = calcular_plusvalias_fifo(df, precios)
+    # La permuta es una venta a 150 € y el ETH entra en cartera con ese coste
+    assert resultado["Ingreso EUR"].tolist() == pytest.approx([150.0, 200.0])
+    assert resultado["Coste EUR (FIFO)"].tolist() == pytest.approx([100.0, 150.0])
+    assert resultado["Ganancia/pérdida EUR"].tolist() == pytest.approx([50.0, 50.0])
+
+def test_permuta_sin_precio_hereda_el_coste():
+    df = transacciones_de([
+        ("2024-01-01", "Trade", "EUR", 100.0, "BTC", 1.0, 0.0),
+        ("2024-02-01", "Trade", "BTC", 1.0, "ETH", 10.0, 0.0),
+        ("2024-03-01", "Trade", "ETH", 10.0, "EUR", 200.0, 0.0),
+    ])
+    precios = _almacen([("BTC", "2023-01-01", 90.0)])  # demasiado antiguo
+    resultado = calcular_plusvalias_fifo(df, precios)
+    pd.testing.assert_frame_equal(resultado, calcular_plusvalias_fifo(df))
+    assert resultado["Ganancia/pérdida EUR"].tolist() == pytest.approx([0.0, 100.0])
+
+def test_staking_entra_en_cartera_a_su_valor():
+    df = transacciones_de([
+        ("2024-01-01", "Staking", None, 0.0, "ETH", 2.0, 0.0),
+        ("2024-01-05", "Staking", None, 0.0, "ETH", 1.0, 0.0),  # sin precio: no forma lote
+        ("2024-03-01", "Trade", "ETH", 3.0, "EUR", 120.0, 0.0),
+    ])
+    precios = _almacen([("ETH", "2024-01-01", 30.0)], tolerancia=pd.Timedelta(days=1))
+    resultado = calcular_plusvalias_fifo(df, precios)
+    assert resultado["Cantidad vendida"].tolist() == [2.0]
+    assert resultado["Coste EUR (FIFO)"].tolist() == pytest.approx([60.0])
+    # Sin precios el staking se ignora, como antes
+    assert calcular_plusvalias_fifo(df)["Cantidad vendida"].tolist() == [0.0]
+
+def test_comision_en_cripto_se_pasa_a_eur():
+    df = transacciones_de([
+        ("2024-01-01", "Trade", "EUR", 100.0, "BTC", 1.0, 0.0),
+        ("2024-02-01", "Trade", "BTC", 1.0, "EUR", 150.0, 0.1),
+        ("2024-02-02", "Trade", "EUR", 10.0, "ETH", 1.0, 0.0),
+        ("2024-03-01", "Trade", "ETH", 1.0, "EUR", 20.0, 2.0),
+    ])
+    df["Fee Asset (optional)"] = ["EUR", "BNB", "EUR", "DOGE"]
+    precios = _almacen([("BNB", "2024-02-01", 300.0)])
+    resultado = calcular_plusvalias_fifo(df, precios)
+    # 0,1 BNB a 300 € son 30 €; la comisión en DOGE no tiene precio y se queda como estaba
+    assert resultado["Comisión"].tolist() == pytest.approx([30.0, 2.0])
+    assert resultado["Ingreso EUR"].tolist() == pytest.approx([120.0, 18.0])
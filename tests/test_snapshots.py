@@ -0,0 +1,95 @@
+# Motor FIFO incremental: reanudación desde snapshots anuales y su política de limpieza
+import os
+import pandas as pd
+import pytest
+import snapshots
+from data_loader import load_multiple_csvs, preprocess_df
+from generador_sintetico import generar_ledger, escribir_csvs
+from processor import calcular_plusvalias_fifo, calcular_plusvalias_fifo_incremental
+
+@pytest.fixture
+def transacciones(tmp_path):
+    rutas = escribir_csvs(generar_ledger(3000, activos=6, semilla=11), str(tmp_path / "csv"), 2)
+    return preprocess_df(load_multiple_csvs(rutas))
+
+@pytest.fixture
+def años_guardados(monkeypatch):
+    años = []
+    guardar = snapshots.guardar_snapshot
+    def registrar(directorio, año, *args):
+        años.append(año)
+        guardar(directorio, año, *args)
+    monkeypatch.setattr(snapshots, "guardar_snapshot", registrar)
+    return años
+
+def test_reanuda_y_recalcula_los_años_posteriores(tmp_path, transacciones, años_guardados):
+    directorio = str(tmp_path / "snapshots")
+    años = pd.to_datetime(transacciones["Date"]).dt.year
+    todos = sorted(años.unique().tolist())
+    assert len(todos) >= 3
+
+    primera = calcular_plusvalias_fifo_incremental(transacciones, directorio)
+    pd.testing.assert_frame_equal(primera, calcular_plusvalias_fifo(transacciones))
+    assert años_guardados == todos
+
+    # Sin cambios no se recalcula ningún año
+    años_guardados.clear()
+    pd.testing.assert_frame_equal(calcular_plusvalias_fifo_incremental(transacciones, directorio), primera)
+    assert años_guardados == []
+
+    # Una compra editada en el segundo año invalida ese año y todos los siguientes
+    editado = transacciones.copy()
+    compras = editado.index[(años == todos[1]) & (editado["Transaction Type"] == "Trade")
+                            & (editado["Outgoing Asset"] == "EUR")]
+    editado.loc[compras[0], "Outgoing Amount"] = float(editado.loc[compras[0], "Outgoing Amount"]) * 3
+    años_guardados.clear()
+    segunda = calcular_plusvalias_fifo_incremental(editado, directorio)
+    assert años_guardados == todos[1:]
+    pd.testing.assert_frame_equal(segunda, calcular_plusvalias_fifo(editado))
+    assert not segunda["Coste EUR (FIFO)"].equals(primera["Coste EUR (FIFO)"])
+
+def test_limpieza_borra_primero_lo_menos_usado(tmp_path, transacciones):
+    directorio = str(tmp_path / "snapshots")
+    calcular_plusvalias_fifo_incremental(transacciones, directorio)
+    ficheros = sorted(os.listdir(directorio))
+    for nombre in ficheros:
+        os.utime(os.path.join(directorio, nombre), (1000, 1000))  # mismo uso para todos
+    tamaño_primero = os.path.getsize(os.path.join(directorio, ficheros[0]))
+
+    # Con el mismo uso se conservan los años anteriores, que son los que permiten reanudar
+    snapshots.limpiar_snapshots(directorio, tamaño_maximo=tamaño_primero)
+    assert os.listdir(directorio) == [ficheros[0]]
+
+    snapshots.limpiar_snapshots(directorio, tamaño_maximo=0)
+    assert os.listdir(directorio) == []
+    snapshots.limpiar_snapshots(str(tmp_path / "no-existe"))
+
+def test_guardados_simultaneos_del_mismo_snapshot(tmp_path):
+    import threading
+    from lots import ColaLotes
+    cola = ColaLotes()
+    cola.agregar(1.0, 100.0, pd.Timestamp("2024-01-01"))
+    errores = []
+
+    def guardar():
+        try:
+            for _ in range(20):
+                snapshots.guardar_snapshot(str(tmp_path), 2024, "h", {"BTC": cola}, {"Fecha": []})
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=guardar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert errores == []
+    assert os.listdir(tmp_path) == ["2024-h.pkl"]
+    assert snapshots.cargar_snapshot(str(tmp_path), 2024, "h")["wallets"]["BTC"]["cantidad"].tolist() == [1.0]
+
+def test_fallo_al_guardar_no_interrumpe(tmp_path, monkeypatch):
+    def fallar(origen, destino):
+        raise OSError("disco lleno")
+    monkeypatch.setattr(snapshots.os, "replace", fallar)
+    snapshots.guardar_snapshot(str(tmp_path), 2024, "h", {}, {"Fecha": []})
+    assert os.listdir(tmp_path) == []
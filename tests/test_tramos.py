@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from tax_utils import calcular_impuestos, calcular_impuestos_vectorizado
+
+# Cuotas calculadas a mano con la tabla de cada año
+@pytest.mark.parametrize("año, ganancia, cuota", [
+    (2015, 250000, 57630.0),
+    (2016, 250000, 56380.0),
+    (2019, 250000, 56380.0),
+    (2020, 250000, 56380.0),
+    (2021, 250000, 57880.0),
+    (2022, 250000, 57880.0),
+    (2023, 350000, 85880.0),
+    (2024, 350000, 85880.0),
+    (2025, 350000, 86880.0),
+    (2026, 350000, 86880.0),
+    (2019, 5000, 950.0),
+    (2024, 0, 0.0),
+    (None, 250000, 58380.0),
+])
+def test_cuota_por_año(año, ganancia, cuota):
+    assert calcular_impuestos(ganancia, año) == pytest.approx(cuota)
+
+def test_vectorizado_con_un_año_por_ganancia():
+    años = np.array([2019, 2021, 2023, 2025])
+    cuotas = calcular_impuestos_vectorizado(np.full(4, 350000.0), años)
+    esperadas = [calcular_impuestos(350000, int(año)) for año in años]
+    np.testing.assert_allclose(cuotas, esperadas)
+    assert cuotas[0] == pytest.approx(79380.0)
@@ -0,0 +1,169 @@
+# trabajos.py
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from data_loader import hash_contenido, huella_reglas
+import instrumentacion
+
+DIRECTORIO_TRABAJOS = os.path.join("data", "trabajos")
+VERSION_TRABAJOS = "3"
+# Límites de los resultados guardados: se borran los trabajos más antiguos, como en la caché de subidas
+TAMAÑO_MAXIMO_TRABAJOS = 1024 * 1024 * 1024  # bytes
+ANTIGÜEDAD_MAXIMA_TRABAJOS = 7 * 24 * 60 * 60  # segundos sin usarse
+
+# Estados de un trabajo
+PENDIENTE, EN_CURSO, TERMINADO, ERROR = "pendiente", "en curso", "terminado", "error"
+
+def clave_trabajo(hashes: list[str] | tuple[str, ...]) -> str:
+    """
+    Identificador de un conjunto de subidas: dos envíos con los mismos ficheros (y las mismas
+    reglas de clasificación) son el mismo trabajo.
+    """
+    return hashlib.sha256((VERSION_TRABAJOS + huella_reglas() + "".join(hashes)).encode()).hexdigest()[:32]
+
+class GestorTrabajos:
+    """
+    Ejecuta `funcion(contenidos, progreso)` en un pool de hilos, fuera del hilo de la interfaz.
+    Cada trabajo tiene una carpeta en `directorio` con su estado (estado.json, actualizado en cada
+    etapa) y sus resultados en Parquet, así que la tabla de trabajos sobrevive a reinicios.
+    `funcion` llama a progreso(nombre_etapa) al empezar cada etapa y devuelve un dict de DataFrames.
+    """
+
+    def __init__(self, funcion, etapas: list[str], directorio: str = DIRECTORIO_TRABAJOS, workers: int = 2,
+                 tamaño_maximo: int = TAMAÑO_MAXIMO_TRABAJOS, antigüedad_maxima: float = ANTIGÜEDAD_MAXIMA_TRABAJOS):
+        self.funcion = funcion
+        self.etapas = list(etapas) + ["guardado"]
+        self.directorio = directorio
+        self.tamaño_maximo = tamaño_maximo
+        self.antigüedad_maxima = antigüedad_maxima
+        self._pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="trabajo")
+        self._activos = {}
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        self.limpiar()
+
+    def _ruta(self, clave: str, nombre: str = "estado.json") -> str:
+        return os.path.join(self.directorio, clave, nombre)
+
+    def _guardar_estado(self, estado: dict):
+        estado["actualizado"] = time.time()
+        ruta = self._ruta(estado["id"])
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, ruta)
+
+    def estado(self, clave: str) -> dict | None:
+        try:
+            with open(self._ruta(clave), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def enviar(self, contenidos: list[bytes], hashes: list[str] | tuple[str, ...] | None = None,
+               funcion=None) -> str:
+        """
+        Encola un conjunto de subidas y devuelve su identificador. Si ya hay un trabajo con el mismo
+        contenido terminado o en marcha en este proceso, no se vuelve a lanzar. `funcion` sustituye
+        a la del gestor para este trabajo; `hashes` debe identificar entonces su entrada.
+        """
+        if hashes is None:
+            hashes = [hash_contenido(contenido) for contenido in contenidos]
+        clave = clave_trabajo(hashes)
+        with self._lock:
+            futuro = self._activos.get(clave)
+            if futuro is not None and not futuro.done():
+                return clave
+            estado = self.estado(clave)
+            if estado is not None and estado["estado"] == TERMINADO:
+                return clave
+            # Trabajo nuevo, fallido o interrumpido por un reinicio: se lanza de nuevo
+            os.makedirs(os.path.join(self.directorio, clave), exist_ok=True)
+            self._guardar_estado({
+                "id": clave, "estado": PENDIENTE, "etapa": None, "progreso": 0.0, "ficheros": len(contenidos),
+                "creado": time.time(), "etapas": [], "resultados": [], "error": None,
+            })
+            self._activos[clave] = self._pool.submit(self._ejecutar, clave, contenidos, funcion or self.funcion)
+        return clave
+
+    def _ejecutar(self, clave: str, contenidos: list[bytes], funcion):
+        estado = self.estado(clave)
+        estado["estado"] = EN_CURSO
+
+        def progreso(etapa: str):
+            ahora = time.time()
+            if estado["etapas"]:
+                estado["etapas"][-1]["segundos"] = ahora - estado["etapas"][-1]["inicio"]
+            estado["etapas"].append({"etapa": etapa, "inicio": ahora, "segundos": None})
+            estado["etapa"] = etapa
+            hechas = self.etapas.index(etapa) if etapa in self.etapas else len(estado["etapas"]) - 1
+            estado["progreso"] = hechas / len(self.etapas)
+            self._guardar_estado(estado)
+
+        # Las etapas medidas con medir_etapa se registran en este hilo: se guardan con el estado
+        instrumentacion.reiniciar()
+        try:
+            resultados = funcion(contenidos, progreso)
+            progreso("guardado")
+            for nombre, df in resultados.items():
+                df.to_parquet(self._ruta(clave, f"{nombre}.parquet"))
+            estado["etapas"][-1]["segundos"] = time.time() - estado["etapas"][-1]["inicio"]
+            estado.update({"estado": TERMINADO, "etapa": None, "progreso": 1.0, "resultados": sorted(resultados)})
+        except Exception as e:
+            estado.update({"estado": ERROR, "error": f"{type(e).__name__}: {e}", "traza": traceback.format_exc()})
+        rendimiento = instrumentacion.informe()
+        estado["rendimiento"] = rendimiento.astype(object).where(rendimiento.notna(), None).to_dict("records")
+        self._guardar_estado(estado)
+        self.limpiar()
+
+    def limpiar(self):
+        """
+        Borra los trabajos que llevan más de `antigüedad_maxima` sin usarse y, si los resultados
+        guardados superan `tamaño_maximo`, los menos usados recientemente. Los trabajos en marcha
+        no se borran.
+        """
+        with self._lock:
+            en_marcha = {clave for clave, futuro in self._activos.items() if not futuro.done()}
+            total, candidatos = 0, []
+            for clave in os.listdir(self.directorio):
+                ruta = os.path.join(self.directorio, clave)
+                try:
+                    tamaño = sum(entrada.stat().st_size for entrada in os.scandir(ruta) if entrada.is_file())
+                    usado = os.stat(ruta).st_mtime
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                total += tamaño
+                if clave not in en_marcha:
+                    candidatos.append((usado, tamaño, clave))
+
+            limite_uso = time.time() - self.antigüedad_maxima
+            for usado, tamaño, clave in sorted(candidatos):
+                if usado >= limite_uso and total <= self.tamaño_maximo:
+                    break
+                self._activos.pop(clave, None)
+                shutil.rmtree(os.path.join(self.directorio, clave), ignore_errors=True)
+                total -= tamaño
+
+    def descartar(self, clave: str) -> bool:
+        """
+        Borra un trabajo terminado o fallido para que el próximo envío lo recalcule.
+        """
+        with self._lock:
+            futuro = self._activos.get(clave)
+            if futuro is not None and not futuro.done():
+                return False
+            self._activos.pop(clave, None)
+            shutil.rmtree(os.path.join(self.directorio, clave), ignore_errors=True)
+        return True
+
+    def resultado(self, clave: str, nombre: str) -> pd.DataFrame:
+        df = pd.read_parquet(self._ruta(clave, nombre + ".parquet"))
+        os.utime(os.path.join(self.directorio, clave))  # Marca de uso reciente para limpiar()
+        return df
@@ -1,157 +1,260 @@
 # visualizer.py
 
+import os
 import streamlit as st
 import pandas as pd
-from st_aggrid import AgGrid, GridOptionsBuilder
-import plotly.express as px
+from processor import construir_cubo, resumen_por_cripto, ganancias_por_periodo
+from consultas import ConsultaTabla
+from almacen import AlmacenTransacciones
+from instrumentacion import etapa, medir_etapa
 
-def mostrar_resumen(resultados_df: pd.DataFrame):
-    if resultados_df.empty:
-        st.warning("No se han encontrado operaciones con plusvalías.")
-        return
-    col1, _, col3 = st.columns((5,0.2,2))
+# plotly.express y st_aggrid se importan dentro de las funciones que dibujan: importar este módulo
+# no los carga y la página no los paga hasta mostrar la primera tabla o gráfico
 
-    with col1:
-        gb = GridOptionsBuilder.from_dataframe(resultados_df)
-        gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
-        gb.configure_side_bar()  # Barra lateral para filtros avanzados
-
-        grid_options = gb.build()
-
-        # Mostrar tabla interactiva
-        grid_response = AgGrid(
-            resultados_df,
-            gridOptions=grid_options,
-            enable_enterprise_modules=True,
-            theme="streamlit",  # Cambiar tema si es necesario
-            height=650,
-            fit_columns_on_grid_load=True
-        )
+TAMAÑOS_PAGINA = [50, 100, 500, 1000]
 
-    with col3:
-        total_ganancia = resultados_df["Ganancia/pérdida EUR"].sum()
-        total_operaciones = len(resultados_df)
-        ganancia_promedio = total_ganancia / total_operaciones if total_operaciones > 0 else 0
+@medir_etapa("tabla paginada")
+def mostrar_tabla_paginada(consulta: ConsultaTabla, clave: str, columnas_filtro: list[str] = (),
+                           columna_fecha: str | None = None, altura: int = 400) -> ConsultaTabla:
+    """
+    Tabla AgGrid paginada en el servidor: los filtros, el orden y los totales se calculan sobre
+    la tabla Arrow y al navegador solo se envía la página visible. Devuelve la consulta filtrada.
+    """
+    columnas = st.columns(len(columnas_filtro) + (2 if columna_fecha else 0) or 1)
+    valores = {}
+    for col, columna in zip(columnas, columnas_filtro):
+        with col:
+            valores[columna] = st.multiselect(columna, consulta.valores_unicos(columna), key=f"{clave}-filtro-{columna}")
+    desde = hasta = None
+    if columna_fecha:
+        with columnas[-2]:
+            desde = st.date_input("Desde", value=None, key=f"{clave}-desde")
+        with columnas[-1]:
+            hasta = st.date_input("Hasta", value=None, key=f"{clave}-hasta")
+    filtrada = consulta.filtrar(valores, columna_fecha, desde, hasta)
 
-        st.metric("🧾 Ganancia/Pérdida Total", f"{total_ganancia:,.2f} €")
-        st.metric("📊 Total Operaciones", total_operaciones)
-        st.metric("📈 Ganancia Promedio", f"{ganancia_promedio:,.2f} €")
+    col_orden, col_sentido, col_tamaño, col_pagina = st.columns(4)
+    with col_orden:
+        orden = st.selectbox("Ordenar por", [None] + consulta.columnas, key=f"{clave}-orden",
+                             format_func=lambda c: "—" if c is None else c)
+    with col_sentido:
+        descendente = st.toggle("Descendente", key=f"{clave}-descendente")
+    with col_tamaño:
+        tamaño = st.selectbox("Filas por página", TAMAÑOS_PAGINA, index=1, key=f"{clave}-tamaño")
+    with col_pagina:
+        paginas = filtrada.num_paginas(tamaño)
+        numero = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, key=f"{clave}-pagina")
+
+    pagina = filtrada.pagina(numero, tamaño, orden, descendente)
 
-    # Filtros para monedas y rango de fechas
-    monedas = resultados_df["Cripto"].unique()
-    moneda_seleccionada = st.multiselect("Filtrar por moneda", monedas, default=monedas)
+    from st_aggrid import AgGrid, GridOptionsBuilder
+    gb = GridOptionsBuilder.from_dataframe(pagina)
+    # Sin filtros, orden ni edición en la tabla: solo verían la página visible y los totales no los
+    # tendrían en cuenta. Los únicos filtros son los de arriba, que se aplican a toda la tabla.
+    gb.configure_default_column(editable=False, filter=False, sortable=False, resizable=True)
 
-    fechas = pd.to_datetime(resultados_df["Fecha"])
-    fecha_min, fecha_max = fechas.min(), fechas.max()
-    rango_fechas = st.date_input("Filtrar por rango de fechas", [fecha_min, fecha_max])
+    grid_options = gb.build()
 
-    # Filtrar el DataFrame
-    resultados_filtrados = resultados_df[
-        (resultados_df["Cripto"].isin(moneda_seleccionada)) &
-        (fechas.between(pd.to_datetime(rango_fechas[0]), pd.to_datetime(rango_fechas[1])))
-    ]
+    # Mostrar tabla interactiva
+    AgGrid(
+        pagina,
+        gridOptions=grid_options,
+        enable_enterprise_modules=False,
+        theme="streamlit",  # Cambiar tema si es necesario
+        height=altura,
+        fit_columns_on_grid_load=True
+    )
+    primera = (numero - 1) * tamaño
+    st.caption(f"Filas {min(primera + 1, len(filtrada))}–{primera + len(pagina)} de {len(filtrada)}")
+    return filtrada
+
+# Secciones del resumen: solo se construyen las figuras y tablas de la que está abierta
+SECCIONES_RESUMEN = ["📋 Operaciones", "📈 Gráfico por operación", "📊 Resumen por moneda"]
+# Por encima de este número de operaciones el gráfico de barras se agrega por día, semana o mes
+MAX_BARRAS = 1500
+MAX_FIGURAS_CACHE = 64
 
-    # Gráfico
-    fig = px.bar(
-        resultados_filtrados,
+@st.cache_resource(max_entries=MAX_FIGURAS_CACHE)
+def _figura_operaciones(clave, criptos: tuple, desde, hasta, _almacen: AlmacenTransacciones, _cubo: pd.DataFrame):
+    """
+    Gráfico de barras por operación para un estado de los filtros. Con más de MAX_BARRAS
+    operaciones se dibuja la serie agregada del cubo en lugar de una barra por operación.
+    """
+    import plotly.express as px
+    num_operaciones = len(_almacen.posiciones(*criptos, desde=desde, hasta=hasta))
+    if num_operaciones <= MAX_BARRAS:
+        datos = _almacen.filas(*criptos, desde=desde, hasta=hasta)
+        titulo = "Ganancia/Pérdida por operación"
+    else:
+        datos, periodo = ganancias_por_periodo(_cubo, criptos, desde, hasta, MAX_BARRAS)
+        titulo = f"Ganancia/Pérdida por {periodo} ({num_operaciones} operaciones agregadas)"
+    return px.bar(
+        datos,
         x="Fecha",
         y="Ganancia/pérdida EUR",
         color="Cripto",
-        title="Ganancia/Pérdida por operación",
+        title=titulo,
         labels={"Ganancia/pérdida EUR": "€"}
     )
-    st.plotly_chart(fig, use_container_width=True)
 
-    # Resumen de ganancias por moneda
-    resumen_ganancias = resultados_df[resultados_df["Ganancia/pérdida EUR"] > 0].groupby("Cripto")["Ganancia/pérdida EUR"].sum().reset_index()
-    resumen_ganancias["Porcentaje"] = (resumen_ganancias["Ganancia/pérdida EUR"] / resumen_ganancias["Ganancia/pérdida EUR"].sum()) * 100
+@st.cache_resource(max_entries=MAX_FIGURAS_CACHE)
+def _figura_reparto(clave, titulo: str, _datos: pd.DataFrame):
+    import plotly.express as px
+    figura = px.pie(
+        _datos,
+        names="Cripto",
+        values="Porcentaje",
+        title=titulo,
+        labels={"Porcentaje": "%"}
+    )
+    figura.update_traces(textinfo='none')  # Quitar valores porcentuales del gráfico
+    return figura
 
-    # Resumen de pérdidas por moneda
-    resumen_perdidas = resultados_df[resultados_df["Ganancia/pérdida EUR"] < 0].groupby("Cripto")["Ganancia/pérdida EUR"].sum().reset_index()
-    resumen_perdidas["Porcentaje"] = (resumen_perdidas["Ganancia/pérdida EUR"].abs() / resumen_perdidas["Ganancia/pérdida EUR"].abs().sum()) * 100
+@medir_etapa("mostrar_resumen")
+def mostrar_resumen(resultados_df: pd.DataFrame, cubo: pd.DataFrame | None = None,
+                    consulta: ConsultaTabla | None = None, almacen: AlmacenTransacciones | None = None,
+                    clave=None):
+    """
+    Métricas generales y una sección a elegir (tabla, gráfico por operación o resumen por moneda).
+    `clave` identifica los datos para reutilizar las figuras entre ejecuciones; por defecto se
+    calcula a partir del cubo.
+    """
+    if resultados_df.empty:
+        st.warning("No se han encontrado operaciones con plusvalías.")
+        return
+    if cubo is None:
+        cubo = construir_cubo(resultados_df)
+    if clave is None:
+        clave = int(pd.util.hash_pandas_object(cubo).sum())
+    resumen_cripto = resumen_por_cripto(cubo)
 
-    # Resumen por moneda
-    st.subheader("📊 Resumen por Moneda")
-    st.subheader("Distribución de Ganancias y Pérdidas por Moneda")
-    col1,_, col3 = st.columns((3,0.2, 2))
+    # Métricas: salen del cubo, así que se muestran siempre
+    total_ganancia = resumen_cripto["Ganancia/pérdida EUR"].sum()
+    total_operaciones = int(resumen_cripto["Operaciones"].sum())
+    ganancia_promedio = total_ganancia / total_operaciones if total_operaciones > 0 else 0
 
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
-        
-        resumen_por_moneda = resultados_df.groupby("Cripto")["Ganancia/pérdida EUR"].sum().reset_index()
-
-        # Añadir columna de porcentaje de ganancias
-        resumen_por_moneda = resumen_por_moneda.merge(
-            resumen_ganancias[["Cripto", "Porcentaje"]].rename(columns={"Porcentaje": "Porcentaje Ganancias"}),
-            on="Cripto",
-            how="left"
-        )
-
-        # Añadir columna de porcentaje de pérdidas
-        resumen_por_moneda = resumen_por_moneda.merge(
-            resumen_perdidas[["Cripto", "Porcentaje"]].rename(columns={"Porcentaje": "Porcentaje Pérdidas"}),
-            on="Cripto",
-            how="left"
-        )
-
-        # Rellenar NaN con 0 para porcentajes
-        resumen_por_moneda["Porcentaje Ganancias"] = resumen_por_moneda["Porcentaje Ganancias"].fillna(0)
-        resumen_por_moneda["Porcentaje Pérdidas"] = resumen_por_moneda["Porcentaje Pérdidas"].fillna(0)
-        
-        gb = GridOptionsBuilder.from_dataframe(resumen_por_moneda)
-        gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
-        gb.configure_side_bar()  # Barra lateral para filtros avanzados
-
-        grid_options = gb.build()
-
-        # Mostrar tabla interactiva
-        grid_response = AgGrid(
-            resumen_por_moneda,
-            gridOptions=grid_options,
-            enable_enterprise_modules=True,
-            theme="streamlit",  # Cambiar tema si es necesario
-            height=650,
-            fit_columns_on_grid_load=True
-        )
-
+        st.metric("🧾 Ganancia/Pérdida Total", f"{total_ganancia:,.2f} €")
+        st.metric("📊 Total Operaciones", total_operaciones)
+    with col2:
+        st.metric("📈 Ganancia Promedio", f"{ganancia_promedio:,.2f} €")
     with col3:
-        # Subcolumnas para los gráficos
-        subcol1, subcol2 = st.columns(2)
-
-        with subcol1:
-            # Gráfico de pastel para ganancias
-            fig_ganancias = px.pie(
-            resumen_ganancias,
-            names="Cripto",
-            values="Porcentaje",
-            title="Distribución de Ganancias por Moneda",
-            labels={"Porcentaje": "%"}
-            )
-            fig_ganancias.update_traces(textinfo='none')  # Quitar valores porcentuales del gráfico
-            st.plotly_chart(fig_ganancias, use_container_width=True)
-
-        with subcol2:
-            # Gráfico de pastel para pérdidas
-            fig_perdidas = px.pie(
-            resumen_perdidas,
-            names="Cripto",
-            values="Porcentaje",
-            title="Distribución de Pérdidas por Moneda",
-            labels={"Porcentaje": "%"}
-            )
-            fig_perdidas.update_traces(textinfo='none')  # Quitar valores porcentuales del gráfico
-            st.plotly_chart(fig_perdidas, use_container_width=True)
-
-        col1, col2 = st.columns(2)
+        st.metric("📈 Máxima Ganancia", f"{cubo['Máxima ganancia'].max():,.2f} €")
+        st.metric("📉 Mínima Ganancia", f"{cubo['Mínima ganancia'].min():,.2f} €")
+    with col4:
+        st.metric("✅ Operaciones Positivas", resumen_cripto["Operaciones positivas"].sum())
+        st.metric("❌ Operaciones Negativas", resumen_cripto["Operaciones negativas"].sum())
+
+    seccion = st.radio("Sección", SECCIONES_RESUMEN, horizontal=True, key="resumen-seccion",
+                       label_visibility="collapsed")
+
+    if seccion == SECCIONES_RESUMEN[0]:
+        if consulta is None:
+            consulta = ConsultaTabla(resultados_df)
+        mostrar_tabla_paginada(consulta, "plusvalias", ["Cripto"], columna_fecha="Fecha", altura=650)
+
+    elif seccion == SECCIONES_RESUMEN[1]:
+        if almacen is None:
+            almacen = AlmacenTransacciones(resultados_df, "Fecha", claves=("Cripto",))
+
+        # Filtros para monedas y rango de fechas
+        monedas = resumen_cripto["Cripto"].tolist()
+        moneda_seleccionada = st.multiselect("Filtrar por moneda", monedas, default=monedas)
+
+        fechas_cubo = cubo.index.get_level_values("Fecha")
+        fecha_min, fecha_max = fechas_cubo.min(), fechas_cubo.max()
+        rango_fechas = st.date_input("Filtrar por rango de fechas", [fecha_min, fecha_max])
+
+        # Gráfico (memorizado por estado de los filtros)
+        with etapa("gráfico por operación"):
+            fig = _figura_operaciones(clave, tuple(moneda_seleccionada), rango_fechas[0], rango_fechas[-1], almacen, cubo)
+            st.plotly_chart(fig, use_container_width=True)
+
+    else:
+        # Resumen de ganancias y pérdidas por moneda
+        resumen_ganancias = resumen_cripto.loc[resumen_cripto["Operaciones positivas"] > 0, ["Cripto", "Ganancias EUR", "Porcentaje Ganancias"]]
+        resumen_ganancias = resumen_ganancias.rename(columns={"Ganancias EUR": "Ganancia/pérdida EUR", "Porcentaje Ganancias": "Porcentaje"})
+        resumen_perdidas = resumen_cripto.loc[resumen_cripto["Operaciones negativas"] > 0, ["Cripto", "Pérdidas EUR", "Porcentaje Pérdidas"]]
+        resumen_perdidas = resumen_perdidas.rename(columns={"Pérdidas EUR": "Ganancia/pérdida EUR", "Porcentaje Pérdidas": "Porcentaje"})
+
+        # Resumen por moneda
+        st.subheader("📊 Resumen por Moneda")
+        st.subheader("Distribución de Ganancias y Pérdidas por Moneda")
+        col1,_, col3 = st.columns((3,0.2, 2))
 
         with col1:
-            max_ganancia = resultados_df["Ganancia/pérdida EUR"].max()
-            st.metric("📈 Máxima Ganancia", f"{max_ganancia:,.2f} €")
+            resumen_por_moneda = resumen_cripto[["Cripto", "Ganancia/pérdida EUR", "Porcentaje Ganancias", "Porcentaje Pérdidas"]].fillna(0)
 
-            min_ganancia = resultados_df["Ganancia/pérdida EUR"].min()
-            st.metric("📉 Mínima Ganancia", f"{min_ganancia:,.2f} €")
+            from st_aggrid import AgGrid, GridOptionsBuilder
+            gb = GridOptionsBuilder.from_dataframe(resumen_por_moneda)
+            gb.configure_default_column(editable=True, filter=True, sortable=True, resizable=True)
+            gb.configure_side_bar()  # Barra lateral para filtros avanzados
 
-        with col2:
-            operaciones_positivas = (resultados_df["Ganancia/pérdida EUR"] > 0).sum()
-            operaciones_negativas = (resultados_df["Ganancia/pérdida EUR"] < 0).sum()
-            st.metric("✅ Operaciones Positivas", operaciones_positivas)
-            st.metric("❌ Operaciones Negativas", operaciones_negativas)
+            grid_options = gb.build()
+
+            # Mostrar tabla interactiva
+            with etapa("tabla resumen por moneda", len(resumen_por_moneda)):
+                AgGrid(
+                    resumen_por_moneda,
+                    gridOptions=grid_options,
+                    enable_enterprise_modules=True,
+                    theme="streamlit",  # Cambiar tema si es necesario
+                    height=650,
+                    fit_columns_on_grid_load=True
+                )
+
+        with col3:
+            # Subcolumnas para los gráficos
+            subcol1, subcol2 = st.columns(2)
+
+            with subcol1:
+                # Gráfico de pastel para ganancias
+                with etapa("gráfico de ganancias", len(resumen_ganancias)):
+                    fig_ganancias = _figura_reparto(clave, "Distribución de Ganancias por Moneda", resumen_ganancias)
+                    st.plotly_chart(fig_ganancias, use_container_width=True)
+
+            with subcol2:
+                # Gráfico de pastel para pérdidas
+                with etapa("gráfico de pérdidas", len(resumen_perdidas)):
+                    fig_perdidas = _figura_reparto(clave, "Distribución de Pérdidas por Moneda", resumen_perdidas)
+                    st.plotly_chart(fig_perdidas, use_container_width=True)
+
+def _tabla_rendimiento(informe_df: pd.DataFrame) -> pd.DataFrame:
+    return informe_df.assign(
+        **{"memoria (MB)": informe_df["memoria_delta_bytes"] / 2**20}
+    ).drop(columns=["memoria_delta_bytes"])
+
+def mostrar_rendimiento(informe_df: pd.DataFrame, rutas_perfil: dict | None = None,
+                        informe_trabajo: pd.DataFrame | None = None):
+    """
+    Panel plegable con los tiempos de cada etapa de la última ejecución y, si se pasa
+    `informe_trabajo`, los del trabajo en segundo plano que calculó los resultados.
+    """
+    with st.expander("⏱️ Rendimiento", expanded=False):
+        if informe_df.empty:
+            st.caption("No se ha registrado ninguna etapa en esta ejecución.")
+        else:
+            st.dataframe(_tabla_rendimiento(informe_df), use_container_width=True, hide_index=True)
+            st.caption(f"Tiempo total registrado: {informe_df['segundos'].sum():.3f} s. "
+                       "Las etapas anidadas incluyen el tiempo de las interiores.")
+        if informe_trabajo is not None and not informe_trabajo.empty:
+            st.markdown("**Trabajo en segundo plano**")
+            st.dataframe(_tabla_rendimiento(informe_trabajo), use_container_width=True, hide_index=True)
+        for tipo, ruta in (rutas_perfil or {}).items():
+            with open(ruta, "rb") as f:
+                st.download_button(f"Descargar volcado {tipo}", f.read(), file_name=os.path.basename(ruta),
+                                   key=f"descarga-{tipo}")
+
+def mostrar_progreso_trabajo(estado: dict):
+    """
+    Progreso de un trabajo en segundo plano: etapa actual, barra y tiempos de las etapas terminadas.
+    """
+    if estado["estado"] == "error":
+        st.error(f"El procesamiento ha fallado: {estado['error']}")
+        return
+    etapa_actual = estado["etapa"] or "en cola"
+    st.progress(estado["progreso"], text=f"Procesando ficheros… ({etapa_actual})")
+    hechas = [e for e in estado["etapas"] if e["segundos"] is not None]
+    if hechas:
+        st.caption(" · ".join(f"{e['etapa']}: {e['segundos']:.1f} s" for e in hechas))